@@ -1,18 +1,10 @@
 import logging
 import os
-import json
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    filename='bot.log',
-    filemode='a'
-)
+from blacklist import Blacklist
+from log_setup import setup_logging
 
 logger = logging.getLogger(__name__)
 
@@ -25,43 +17,22 @@ def is_admin(user_id: int) -> bool:
     return str(user_id) in ADMINS
 
 
-def load_blacklist():
-    """Load the blacklist from the JSON file."""
-    if not os.path.exists(BLACKLIST_FILE):
-        return set()
-    with open(BLACKLIST_FILE, "r") as file:
-        return set(json.load(file))
-
-
-def save_blacklist(blacklist):
-    """Save the blacklist to the JSON file."""
-    with open(BLACKLIST_FILE, "w") as file:
-        json.dump(list(blacklist), file)
-
-
 def add_to_blacklist(league_name: str):
     """Add a league name to the blacklist."""
-    blacklist = load_blacklist()
     blacklist.add(league_name)
-    save_blacklist(blacklist)
 
 
 def get_blacklist():
     """Retrieve the blacklist."""
-    return load_blacklist()
+    return blacklist.get()
 
 def remove_from_blacklist(league_name: str):
     """Remove a league name from the blacklist."""
-    blacklist = load_blacklist()
-    if league_name in blacklist:
-        blacklist.remove(league_name)
-        save_blacklist(blacklist)
-        return True
-    return False
+    return blacklist.remove(league_name)
 
 def clear_blacklist():
     """Clear all entries from the blacklist."""
-    save_blacklist(set())
+    blacklist.clear()
 
 async def clear_blacklist_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /clear_blacklist command."""
@@ -241,12 +212,20 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 if __name__ == "__main__":
     load_dotenv()
 
-    # File to store the blacklist
+    # The admin bot logs to its own file, separate from the line change bot
+    setup_logging(os.getenv("ADMIN_LOG_FILE") or "admin_bot.log",
+                  level=os.getenv("LOG_LEVEL") or "INFO",
+                  max_bytes=int(os.getenv("LOG_MAX_BYTES") or 50 * 1024 * 1024),
+                  backup_count=int(os.getenv("LOG_BACKUP_COUNT") or 5),
+                  rotate_when=os.getenv("LOG_ROTATE_WHEN"))
+
+    # File to store the blacklist, shared with the line change bot
     BLACKLIST_FILE = os.getenv("BLACKLIST_FILE")
+    blacklist = Blacklist(BLACKLIST_FILE, check_interval=0)
 
     # List of admin Telegram IDs
     ADMINS = os.getenv("ADMINS").split(',')  # Replace with actual admin IDs
-    print(ADMINS, type(ADMINS))
+    logger.info(f"Admins: {ADMINS}")
 
     LOGGING_BOT = os.getenv("LOGGING_BOT")
 
@@ -0,0 +1,150 @@
+import logging
+import time
+from typing import Dict, List
+
+
+class Alert:
+    """A line move which passed the range filter, with the parts of its Telegram message."""
+    __slots__ = ("event_id", "line_type", "flag", "severity", "chat_id", "header", "line", "link", "from_value",
+                 "to_value", "direction", "move_id", "covers", "created_at")
+
+    def __init__(self, event_id: str, line_type: str, flag: str, severity: int, chat_id, header: str, line: str,
+                 link: str, from_value: float = None, to_value: float = None, move_id=None):
+        self.event_id = event_id
+        self.line_type = line_type
+        self.flag = flag
+        self.severity = severity  # higher is stronger, e.g. HARD over MEDIUM over SOFT
+        self.chat_id = chat_id
+        self.header = header  # league, game time, teams and score
+        self.line = line  # the move of this line type
+        self.link = link
+        self.from_value = from_value
+        self.to_value = to_value
+        self.direction = 1 if to_value is not None and from_value is not None and to_value - from_value > 0 else -1
+        self.move_id = move_id  # id of the data point the line moved to
+        self.covers = []  # weaker alerts of the same move, reported by this one
+        self.created_at = time.monotonic()
+
+    def text(self) -> str:
+        return f"{self.header}{self.line}{self.link}"
+
+
+def move_in_range(previous: tuple, from_value: float, to_value: float) -> bool:
+    """Whether a move starts inside the range of a previous alert's (from, to, direction) in the same direction."""
+    direction = 1 if to_value - from_value > 0 else -1
+    if direction != previous[2]:
+        return False
+    if direction == 1:
+        return previous[0] <= from_value < previous[1]
+    return previous[0] >= from_value > previous[1]
+
+
+class AlertHistory:
+    """
+    The last alert of every event per alert level, as (from, to, direction), which the range filter checks new
+    moves against. Kept in the detector state so the range filter carries on after a restart.
+    """
+
+    def __init__(self):
+        self.alerts = {}  # event_id -> flag -> (from, to, direction)
+
+    def last(self, event_id: str, flag: str):
+        return self.alerts.get(event_id, {}).get(flag)
+
+    def record(self, event_id: str, flag: str, from_value: float, to_value: float):
+        self.alerts.setdefault(event_id, {})[flag] = (from_value, to_value, 1 if to_value - from_value > 0 else -1)
+
+    def in_range(self, event_id: str, flag: str, from_value: float, to_value: float):
+        """The previous alert of the same level when this move starts inside its range in the same direction."""
+        previous = self.last(event_id, flag)
+        if previous is not None and move_in_range(previous, from_value, to_value):
+            return previous
+        return None
+
+    def export(self, event_id: str) -> dict:
+        return self.alerts.get(event_id, {})
+
+    def restore(self, event_id: str, alerts: dict):
+        if alerts:
+            self.alerts[event_id] = {flag: tuple(alert) for flag, alert in alerts.items()}
+        else:
+            self.alerts.pop(event_id, None)
+
+    def forget(self, event_id: str):
+        self.alerts.pop(event_id, None)
+
+
+class AlertAggregator:
+    """
+    Coalesces the alerts of an event into one Telegram message.
+    Alerts of an event are grouped for window seconds (0 groups the alerts of one odds response). Of the alerts of
+    one move (the same data point measured from different start points) only the strongest is kept, a later move of
+    the same line type, level and direction replaces the pending one and every other move keeps its own line.
+    The lines are merged under one header, sent to the channel of the strongest alert.
+    """
+
+    def __init__(self, alert_outbox, window: float = 0):
+        self.alert_outbox = alert_outbox
+        self.window = window
+        # event_id -> (line_type, flag, direction) -> Alert, in the order they first alerted
+        self.pending = {}
+        # Called with every alert sent, the detector keeps them in its alert history for the range filter
+        self.record = None
+        self.received = 0
+        self.sent = 0
+
+    def add(self, alert: Alert):
+        self.received += 1
+        group = self.pending.setdefault(alert.event_id, {})
+        for key, current in list(group.items()):
+            if current.line_type == alert.line_type and current.move_id == alert.move_id:
+                if alert.severity < current.severity:
+                    current.covers.append(alert)
+                    return
+                del group[key]
+                alert.covers += [current] + current.covers
+                current.covers = []
+        group[(alert.line_type, alert.flag, alert.direction)] = alert
+
+    def in_range(self, event_id: str, flag: str, from_value: float, to_value: float):
+        """The pending alert of the same level whose range the move starts inside, as (from, to, direction)."""
+        pending_alerts = self.pending.get(event_id, {}).values()
+        for alert in [covered for alert in pending_alerts for covered in [alert] + alert.covers]:
+            if alert.flag != flag:
+                continue
+            pending = (alert.from_value, alert.to_value, alert.direction)
+            if move_in_range(pending, from_value, to_value):
+                return pending
+        return None
+
+    def flush(self, event_id: str = None, now: float = None):
+        """Send the pending groups whose window is over, only the group of event_id when one is given."""
+        now = time.monotonic() if now is None else now
+        for due_event_id in ([event_id] if event_id is not None else list(self.pending)):
+            group = self.pending.get(due_event_id)
+            if group and now - min(alert.created_at for alert in group.values()) >= self.window:
+                self.send(list(self.pending.pop(due_event_id).values()))
+
+    def drain(self):
+        """Send every pending group without waiting for its window, e.g. before stopping."""
+        for event_id in list(self.pending):
+            self.send(list(self.pending.pop(event_id).values()))
+
+    def send(self, alerts: List[Alert]):
+        strongest = max(alerts, key=lambda alert: alert.severity)
+        lines = "".join(alert.line for alert in alerts)
+        # The latest header has the latest game time and score
+        header = max(alerts, key=lambda alert: alert.created_at).header
+        self.alert_outbox.enqueue("alerts", text=f"{header}{lines}{strongest.link}", chat_id=strongest.chat_id,
+                                  parse_mode='HTML', disable_web_page_preview=True)
+        if self.record is not None:
+            covered = [covered for alert in alerts for covered in [alert] + alert.covers]
+            for alert in sorted(covered, key=lambda alert: alert.created_at):
+                self.record(alert)
+        self.sent += 1
+        if len(alerts) > 1:
+            logging.info("Alerts Merged | %s | %s", strongest.event_id,
+                         ", ".join(f"{alert.line_type} {alert.flag}" for alert in alerts))
+
+    def stats(self) -> Dict[str, int]:
+        return {"received": self.received, "sent": self.sent, "pending": len(self.pending)}
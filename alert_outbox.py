@@ -0,0 +1,234 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from collections import Counter, deque
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from circuit_breaker import CircuitBreaker, backoff_delay
+from metrics import Metrics
+
+# Messages of the bots listed first are sent first when several chats are due
+BOT_PRIORITY = {"alerts": 0, "logs": 1}
+
+
+class AlertOutbox:
+    """
+    Bounded queue of Telegram messages delivered by a pool of sender workers.
+    Detection only enqueues messages, the workers keep within the Telegram rate limits
+    (one message per second and 20 per minute to a chat, about 30 per second overall).
+    Every chat has its own queue and a worker only takes a message from a chat whose send slot is due,
+    so a backlog to one chat never holds up the others.
+    """
+
+    def __init__(self, bots: dict, max_size: int = 1000, workers: int = 4, chat_interval: float = 1.0,
+                 chat_messages_per_minute: int = 20, global_messages_per_second: float = 25,
+                 max_retries: int = 3, metrics: Metrics = None):
+        self.bots = bots  # e.g. {"alerts": line_change_bot, "logs": logging_bot}
+        self.max_size = max_size
+        # chat_id -> heap of (bot priority, sequence, enqueued_at, attempt, bot_name, message)
+        self.chat_queues = {}
+        self.sequence = itertools.count()
+        self.queued = 0
+        self.sending = set()  # chats with a message being sent, their messages go out one at a time and in order
+        self.unfinished = 0  # messages queued or being sent
+        self.wakeup = asyncio.Event()  # a message was queued or a chat became free
+        self.idle = asyncio.Event()  # nothing queued nor being sent
+        self.idle.set()
+        self.worker_count = workers
+        self.workers = []
+        self.chat_interval = chat_interval
+        self.chat_messages_per_minute = chat_messages_per_minute
+        self.global_interval = 1 / global_messages_per_second
+        self.max_retries = max_retries
+        self.metrics = metrics
+        # While Telegram is unreachable for a bot its messages wait in the queue instead of each failing on its own
+        self.breakers = {bot_name: CircuitBreaker(f"telegram {bot_name}", metrics=metrics) for bot_name in bots}
+
+        # Next free send slot overall and per chat, plus the recent send slots of each chat
+        self.global_next_send = 0.0
+        self.chat_next_send = {}
+        self.chat_send_history = {}
+
+        self.enqueued = Counter()  # messages queued per bot
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+        self.dequeued = 0
+        self.queue_wait_total = 0.0
+
+    def enqueue(self, bot_name: str, **message) -> bool:
+        """Queue a sendMessage call without waiting for it, message holds the sendMessage keyword arguments."""
+        if self.queued >= self.max_size:
+            self.dropped += 1
+            logging.error(f"Alert Outbox Full, message dropped | {bot_name} | {message.get('chat_id')} | "
+                          f"{message.get('text')}")
+            return False
+        self.push(message.get("chat_id"), (BOT_PRIORITY.get(bot_name, len(BOT_PRIORITY)), next(self.sequence),
+                                           asyncio.get_running_loop().time(), 0, bot_name, message))
+        self.unfinished += 1
+        self.idle.clear()
+        self.enqueued[bot_name] += 1
+        return True
+
+    def push(self, chat_id, entry: tuple):
+        heapq.heappush(self.chat_queues.setdefault(chat_id, []), entry)
+        self.queued += 1
+        self.wakeup.set()
+
+    def start(self):
+        for _ in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self.worker()))
+
+    async def stop(self, timeout: float = 10):
+        """Wait up to timeout seconds for queued messages to go out, then stop the workers."""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Alert Outbox stopped before all messages were sent | {self.stats()}")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def chat_due_at(self, chat_id) -> float:
+        """Loop time of the next send slot of the chat."""
+        due_at = self.chat_next_send.get(chat_id, 0.0)
+        send_history = self.chat_send_history.get(chat_id)
+        if send_history is not None and len(send_history) == send_history.maxlen:
+            due_at = max(due_at, send_history[0] + 60)
+        return due_at
+
+    def reserve_send_slot(self, chat_id) -> float:
+        """Book the next send slot allowed for the chat and return how long to wait for it."""
+        now = asyncio.get_running_loop().time()
+        send_time = max(now, self.global_next_send, self.chat_due_at(chat_id))
+
+        send_history = self.chat_send_history.get(chat_id)
+        if send_history is None:
+            send_history = self.chat_send_history[chat_id] = deque(maxlen=self.chat_messages_per_minute)
+        send_history.append(send_time)
+
+        self.chat_next_send[chat_id] = send_time + self.chat_interval
+        self.global_next_send = send_time + self.global_interval
+        return send_time - now
+
+    def take(self):
+        """
+        The first queued message of the due chat whose message goes first as (chat_id, entry, None), or with no
+        chat due (None, None, seconds until one is due or None when nothing is queued).
+        """
+        now = asyncio.get_running_loop().time()
+        candidates = []
+        wait = None
+        for chat_id, chat_queue in self.chat_queues.items():
+            if not chat_queue or chat_id in self.sending:
+                continue
+            due_in = self.chat_due_at(chat_id) - now
+            if due_in > 0:
+                wait = due_in if wait is None else min(wait, due_in)
+                continue
+            candidates.append((chat_queue[0], chat_id))
+        for entry, chat_id in sorted(candidates, key=lambda candidate: candidate[0][:2]):
+            breaker = self.breakers[entry[4]]
+            if breaker.allow():
+                heapq.heappop(self.chat_queues[chat_id])
+                self.queued -= 1
+                return chat_id, entry, None
+            # While Telegram is unreachable for a bot its messages wait in their queues
+            retry_in = max(breaker.retry_in(), 0.05)
+            wait = retry_in if wait is None else min(wait, retry_in)
+        return None, None, wait
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id, entry, wait = self.take()
+            if entry is None:
+                # Woken by a new message, a chat becoming free or the next chat slot, whichever comes first
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            priority, sequence, enqueued_at, attempt, bot_name, message = entry
+            self.sending.add(chat_id)
+            finished = True
+            try:
+                if attempt == 0:
+                    self.dequeued += 1
+                    queue_wait = loop.time() - enqueued_at
+                    self.queue_wait_total += queue_wait
+                    if self.metrics is not None:
+                        self.metrics.observe("alert_queue_wait_seconds", queue_wait, bot=bot_name)
+                finished = await self.send(chat_id, entry)
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"In Alert Outbox | {bot_name} | {chat_id} | {e}")
+            finally:
+                self.sending.discard(chat_id)
+                if finished:
+                    self.unfinished -= 1
+                    if not self.unfinished:
+                        self.idle.set()
+                self.wakeup.set()
+
+    async def send(self, chat_id, entry: tuple) -> bool:
+        """Send a message, False when it went back to its chat queue to be retried."""
+        loop = asyncio.get_running_loop()
+        priority, sequence, enqueued_at, attempt, bot_name, message = entry
+        breaker = self.breakers[bot_name]
+        # The chat slot is due, this only waits for the overall slot
+        await asyncio.sleep(self.reserve_send_slot(chat_id))
+        started_at = loop.time()
+        try:
+            await self.bots[bot_name].sendMessage(**message)
+        except RetryAfter as e:
+            # Only this chat is flood limited, it tells nothing about Telegram being up for the bot
+            breaker.release()
+            if attempt >= self.max_retries:
+                raise
+            # Telegram tells us exactly how long this chat is blocked for
+            retry_after = e.retry_after
+            if isinstance(retry_after, datetime.timedelta):
+                retry_after = retry_after.total_seconds()
+            self.chat_next_send[chat_id] = loop.time() + retry_after
+            logging.warning(f"Telegram Flood Control, retrying in {retry_after}s | {chat_id}")
+        except BadRequest:
+            # A NetworkError too, but permanent (e.g. chat not found, bad HTML) and Telegram itself is fine
+            breaker.record_success()
+            raise
+        except NetworkError:
+            breaker.record_failure()
+            if attempt >= self.max_retries:
+                raise
+            self.chat_next_send[chat_id] = loop.time() + backoff_delay(attempt, 1, 30)
+        else:
+            breaker.record_success()
+            latency = loop.time() - started_at
+            self.sent += 1
+            self.send_latency_total += latency
+            self.send_latency_max = max(self.send_latency_max, latency)
+            if self.metrics is not None:
+                self.metrics.observe("telegram_send_seconds", latency, bot=bot_name)
+            return True
+        # Retried from the head of its chat queue once the chat is due again
+        self.push(chat_id, (priority, sequence, enqueued_at, attempt + 1, bot_name, message))
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queued,
+            "enqueued": dict(self.enqueued),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "avg_send_latency": round(self.send_latency_total / self.sent, 3) if self.sent else None,
+            "max_send_latency": round(self.send_latency_max, 3),
+            "avg_queue_wait": round(self.queue_wait_total / self.dequeued, 3) if self.dequeued else None,
+            "breakers": {bot_name: breaker.state for bot_name, breaker in self.breakers.items()}
+        }
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import time
+from replay import make_offline_detector, control, summarise
+from stub_server import StubFeed, StubServer
+
+LINE_TYPES = ("1_2", "1_3", "1_5", "1_6")
+BENCHMARK_LOADS = (50, 500, 5000)
+
+
+class SyntheticFeed(StubFeed):
+    """
+    Live events with odds histories generated as the clock advances, the same seed gives the same feed.
+    Each line gets a new data point every few seconds and moves by a quarter to a full goal now and then.
+    """
+
+    def __init__(self, n_events: int, seed: int = 0, start_time: int = 1700000000, history: int = 600):
+        self.random = random.Random(seed)
+        self.start_time = start_time
+        self.history = history  # seconds of odds data points kept per line
+        self.clock = start_time
+        self.next_id = 10 ** 9
+        self.events = []
+        self.lines = {}  # event_id -> line_type -> {"value", "next_at", "points"}
+        for number in range(n_events):
+            event_id = str(10 ** 7 + number)
+            self.events.append({
+                "id": event_id,
+                "time": str(start_time),
+                "league": {"name": f"Synthetic League {number % 40}"},
+                "home": {"name": f"Home {number}"},
+                "away": {"name": f"Away {number}"},
+                "timer": {"tm": 10 + number % 70},
+                "stats": {"goals": ["0", "0"]}
+            })
+            self.lines[event_id] = {
+                line_type: {"value": self.random.choice([-1.5, -0.5, 0.0, 0.75, 2.5, 3.0]),
+                            "next_at": start_time - history, "points": []}
+                for line_type in LINE_TYPES
+            }
+        self.set_clock(start_time)
+
+    def new_point(self, line_type: str, line: dict) -> dict:
+        if self.random.random() < 0.08:
+            line["value"] += self.random.choice([-1.0, -0.75, -0.5, -0.25, 0.25, 0.5, 0.75, 1.0])
+        value = line["value"]
+        handicap = f"{value - 0.25},{value + 0.25}" if (value * 4) % 2 == 1 else f"{value}"
+        self.next_id += 1
+        point = {"id": str(self.next_id), "add_time": str(line["next_at"]), "handicap": handicap, "ss": "0-0",
+                 "time_str": str(max(0, (line["next_at"] - self.start_time) // 60))}
+        if line_type in ("1_2", "1_5"):
+            point.update(home_od="1.900", away_od="1.900")
+        else:
+            point.update(over_od="1.900", under_od="1.900")
+        return point
+
+    def set_clock(self, clock: float):
+        self.clock = clock
+        for event_lines in self.lines.values():
+            for line_type, line in event_lines.items():
+                while line["next_at"] <= clock:
+                    line["points"].append(self.new_point(line_type, line))
+                    line["next_at"] += self.random.choice([2, 3, 5, 8, 13])
+                while line["points"] and int(line["points"][0]["add_time"]) < clock - self.history:
+                    line["points"].pop(0)
+
+    def live_events(self) -> dict:
+        return {"success": 1, "results": self.events}
+
+    def event_odds(self, event_id: str, since_time: int = None) -> dict:
+        odds = {}
+        for line_type, line in self.lines.get(event_id, {}).items():
+            points = line["points"]
+            if since_time is not None:
+                points = [point for point in points if int(point["add_time"]) >= since_time]
+            odds[line_type] = points[::-1]
+        return {"success": 1, "results": {"odds": odds}}
+
+
+async def run_load(n_events: int, cycles: int, cycle_seconds: int, seed: int) -> dict:
+    stub = StubServer(SyntheticFeed, n_events, seed).start()
+    try:
+        detector = make_offline_detector(stub.base_url, fast=True)
+        detector.alert_outbox.start()
+
+        # The first cycle only records the score of each event, the second baselines every line from
+        # the whole odds history and is reported on its own
+        clock = 1700000000
+        await detector.process()
+        clock += cycle_seconds
+        control(stub.base_url, f"clock?t={clock}")
+        started_at = time.perf_counter()
+        await detector.process()
+        baseline_cycle_ms = round((time.perf_counter() - started_at) * 1000, 2)
+        alerts_before = detector.alert_outbox.enqueued["alerts"]
+
+        cycle_latencies = []
+        cpu_started_at = time.process_time()
+        for _ in range(cycles):
+            clock += cycle_seconds
+            control(stub.base_url, f"clock?t={clock}")
+            started_at = time.perf_counter()
+            _, current_events = await detector.process()
+            detector.clean_events(current_events)
+            cycle_latencies.append(time.perf_counter() - started_at)
+        cpu_seconds = time.process_time() - cpu_started_at
+        alerts = detector.alert_outbox.enqueued["alerts"] - alerts_before
+
+        await detector.alert_outbox.stop(timeout=30)
+        await detector.http_client.aclose()
+
+        report = {"events": n_events, "baseline_cycle_ms": baseline_cycle_ms}
+        report.update(summarise(cycle_latencies))
+        report["cpu_ms_per_event_cycle"] = round(cpu_seconds * 1000 / (n_events * cycles), 4)
+        report["alerts"] = alerts
+        report["alerts_per_second"] = round(alerts / sum(cycle_latencies), 2)
+        report["peak_memory_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return report
+    finally:
+        stub.stop()
+
+
+def run_load_process(n_events: int, cycles: int, cycle_seconds: int, seed: int, result_pipe):
+    # Only errors are logged, so the benchmark measures detection rather than logging
+    logging.basicConfig(level=logging.ERROR)
+    result_pipe.send(asyncio.run(run_load(n_events, cycles, cycle_seconds, seed)))
+
+
+def benchmark(loads=BENCHMARK_LOADS, cycles: int = 10, cycle_seconds: int = 5, seed: int = 0) -> list:
+    """Run each load in a fresh process, so the peak memory of one load does not carry over into the next."""
+    reports = []
+    for n_events in loads:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_load_process,
+                                          args=(n_events, cycles, cycle_seconds, seed, sender))
+        process.start()
+        sender.close()  # so a load which crashes ends the recv below instead of blocking it
+        report = receiver.recv()
+        process.join()
+        reports.append(report)
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the detector against synthetic live events.")
+    parser.add_argument("--loads", type=int, nargs="+", default=list(BENCHMARK_LOADS),
+                        help="numbers of concurrent events to benchmark")
+    parser.add_argument("--cycles", type=int, default=10, help="measured cycles per load")
+    parser.add_argument("--cycle-seconds", type=int, default=5, help="feed seconds between cycles")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for load_report in benchmark(args.loads, args.cycles, args.cycle_seconds, args.seed):
+        print(json.dumps(load_report))
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+# File locks are only available on POSIX, elsewhere writes are still atomic but not serialised between processes
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Blacklist:
+    """
+    League blacklist shared by the admin bot and the detector through a JSON file.
+    Reads come from an in-memory set which is reloaded only when the file's inode, mtime or size changes,
+    writes go to a temp file renamed over the original under a file lock so readers never see a torn file.
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.check_interval = check_interval  # seconds between checks of the file for changes
+        self.leagues = frozenset()
+        self.signature = None
+        self.checked_at = None
+
+    def file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """Reload the blacklist from the file if it changed since it was last read."""
+        self.checked_at = time.monotonic()
+        signature = self.file_signature()
+        if signature == self.signature:
+            return
+        if signature is None:
+            self.leagues = frozenset()
+        else:
+            try:
+                with open(self.path, "r") as file:
+                    self.leagues = frozenset(json.load(file))
+            except (OSError, ValueError) as e:
+                logging.error(f"In Loading Blacklist | {self.path} | {e}")
+                return
+        self.signature = signature
+
+    def get(self) -> frozenset:
+        """Retrieve the blacklist."""
+        if self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval:
+            self.reload()
+        return self.leagues
+
+    @contextmanager
+    def locked(self):
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self, leagues):
+        """Atomically replace the blacklist file, must be called while holding the lock."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix=".blacklist-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(sorted(leagues), file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.leagues = frozenset(leagues)
+        self.signature = self.file_signature()
+        self.checked_at = time.monotonic()
+
+    def add(self, league_name: str):
+        """Add a league name to the blacklist."""
+        with self.locked():
+            self.reload()
+            self.save(self.leagues | {league_name})
+
+    def remove(self, league_name: str) -> bool:
+        """Remove a league name from the blacklist."""
+        with self.locked():
+            self.reload()
+            if league_name not in self.leagues:
+                return False
+            self.save(self.leagues - {league_name})
+            return True
+
+    def clear(self):
+        """Clear all entries from the blacklist."""
+        with self.locked():
+            self.save(set())
@@ -1,75 +1,190 @@
 import asyncio
 import datetime
 import logging
-import statistics
+import time
 import os
+import signal
 from dotenv import load_dotenv
-import requests
-from typing import List, Dict
+from typing import List, Dict, Iterable
 from telegram import Bot
 from telegram.request import HTTPXRequest
-import json
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,  # Set the minimum logging level
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Log format
-    datefmt='%Y-%m-%d %H:%M:%S',  # Date-time format
-    filename='bot.log',  # Optional: Log to a file
-    filemode='a'  # Append mode for file
-)
+from http_client import BetsApiClient
+from odds_points import OddsPoint, parse_odds_points
+from line_window import SlidingLineWindow, classify_change
+from line_arrays import NUMPY_AVAILABLE, VECTORIZE_MIN_POINTS, ColumnLineWindow, LineColumns
+from odds_buffer import OddsHistoryBuffer
+from alert_outbox import AlertOutbox
+from rate_limiter import RequestBudget
+from poll_scheduler import PollScheduler
+from state_store import StateStore
+from blacklist import Blacklist
+from recorder import ResponseRecorder
+from metrics import Metrics
+from log_setup import setup_logging
+from sharding import ShardedDetector
+from markets import DEFAULT_SPORT_ID, MarketRegistry
+from event_lifecycle import EventLifecycle
+from event_state import EventState, MarketState
+from incidents import SuspensionManager
+from alert_aggregator import Alert, AlertAggregator, AlertHistory
+from feed_source import FeedSource, PollingFeed, StreamingFeed
+from circuit_breaker import CircuitOpenError, backoff_delay
+
+# Request budget priorities, lower values are served first when the hourly budget is tight
+EVENTS_REQUEST_PRIORITY = 0
+HOT_EVENT_PRIORITY = 1
+INPLAY_EVENT_PRIORITY = 2
+PRELIVE_EVENT_PRIORITY = 3
+# An event stays hot for this many seconds after its line moved
+HOT_EVENT_SECONDS = 300
+INCIDENT_NAMES = {"goal": "Goal", "penalty": "Penalty", "red_card": "Red Card"}
 
 
 class LineChangeDetector:
-    def __init__(self, events_api_url: str, odds_api_url: str, betsapi_token: str):
+    def __init__(self, events_api_url: str, odds_api_url: str, betsapi_token: str, alert_outbox: AlertOutbox,
+                 max_concurrent_requests: int = 20, incremental_odds: bool = True,
+                 request_budget: RequestBudget = None, poll_scheduler: PollScheduler = None,
+                 blacklist: Blacklist = None, recorder: ResponseRecorder = None, metrics: Metrics = None,
+                 markets: MarketRegistry = None, vectorized_detection: bool = False,
+                 alert_aggregator: AlertAggregator = None,
+                 feed_source: FeedSource = None, suspensions: SuspensionManager = None):
         self.events_api_url = events_api_url
         self.odds_api_url = odds_api_url
+        # Delivers the odds of the eligible events every cycle, polled from the odds api unless a push feed is given
+        self.feed_source = feed_source if feed_source is not None else PollingFeed()
         self.betsapi_token = betsapi_token
-        self.last_processed_ids = {}  # Track the last processed ID for each event
-        self.live_event_details = {}
-        self.line_types = {
-            "1_2": "Asian Handicap",
-            "1_3": "Goal Line",
-            "1_5": "1st Half Asian Handicap",
-            "1_6": "1st Half Goal Line"
-        }
+        # Odds for all eligible events are fetched concurrently, capped by this semaphore
+        self.odds_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # Single keep-alive connection pool shared by the events and odds fetchers
+        self.http_client = BetsApiClient(max_connections=max_concurrent_requests + 5,
+                                         max_keepalive_connections=max_concurrent_requests + 5,
+                                         request_budget=request_budget,
+                                         recorder=recorder,
+                                         metrics=metrics)
+        # event_id -> EventState, the details and the last processed data points of every tracked event
+        self.event_states: Dict[str, EventState] = {}
+        # Events whose state changed since the last checkpoint, only these are written to the state store
+        self.changed_events = set()
+        # Events api payload of every event when its details were last updated, unchanged events are not rebuilt
+        self.live_event_payloads = {}
+        # Recent odds data points per event and line type, only new data points are fetched and parsed each cycle
+        self.incremental_odds = incremental_odds
+        self.odds_buffers = {}
+        # Telegram messages are only queued here, delivery happens in the outbox workers
+        self.alert_outbox = alert_outbox
+        # Optionally merges the alerts of an event into one message, without it every alert is sent on its own
+        self.alert_aggregator = alert_aggregator
+        if alert_aggregator is not None:
+            alert_aggregator.record = self.record_alert
+        # Goals, penalties and red cards of the inplay feed, events are suspended for a while after some of them
+        self.suspensions = suspensions if suspensions is not None else SuspensionManager()
+        # Last alert of every event per alert level, for the range filter
+        self.alert_history = AlertHistory()
+        # Decides which events are due for an odds fetch, moving in-play events are polled more often
+        self.poll_scheduler = poll_scheduler if poll_scheduler is not None else PollScheduler()
+        # Blacklisted leagues, cached in memory and shared with the admin bot through the blacklist file
+        self.blacklist = blacklist
+        # Optional hot path timings, served on the metrics endpoint
+        self.metrics = metrics
+        # Sports and markets to fetch and alert on, with their odds fields, thresholds, windows and channels
+        self.markets = markets if markets is not None else MarketRegistry.load()
+        self.line_types = {line_type: market.name for line_type, market in self.markets.markets.items()}
+        # Long odds histories go through the numpy path of detect_changes when numpy is installed
+        self.vectorized_detection = vectorized_detection and NUMPY_AVAILABLE
         self.alerts_channels = {
             "SOFT": os.getenv("SOFT_ALERTS_CHANNEL"),
             "MEDIUM": os.getenv("MEDIUM_ALERTS_CHANNEL"),
             "HARD": os.getenv("HARD_ALERTS_CHANNEL")
         }
+        self.logs_channel = os.getenv("LOGS_CHANNEL")
+
+    def clean_events(self, event_list: Iterable):
+        """Drop the state of every event not in event_list, the events still tracked by the event lifecycle."""
+        keep = event_list if isinstance(event_list, (set, frozenset)) else set(event_list)
+        for tracked in (self.event_states, self.odds_buffers, self.live_event_payloads):
+            for event_id in [event_id for event_id in tracked if event_id not in keep]:
+                del tracked[event_id]
+        for event_id in [event_id for event_id in self.poll_scheduler.next_due if event_id not in keep]:
+            self.poll_scheduler.remove(event_id)
+        for event_id in [event_id for event_id in self.alert_history.alerts if event_id not in keep]:
+            self.alert_history.forget(event_id)
+        for event_id in [event_id for event_id in self.suspensions.suspended() if event_id not in keep]:
+            self.suspensions.forget(event_id)
+
+    def record_alert(self, alert: Alert):
+        """Keep a sent alert in the alert history, the range filter checks the next moves against it."""
+        self.alert_history.record(alert.event_id, alert.flag, alert.from_value, alert.to_value)
+        self.changed_events.add(alert.event_id)
+
+    def export_state(self) -> dict:
+        """Per event detector state for the state store."""
+        return {
+            event_id: {**state.export(), "alerts": self.alert_history.export(event_id)}
+            for event_id, state in self.event_states.items()
+        }
 
-    def clean_events(self, event_list: list):
-        for event_id in list(self.live_event_details.keys()):
-            if event_id not in event_list:
-                del self.live_event_details[event_id]
-        for event_id in list(self.last_processed_ids.keys()):
-            if event_id not in event_list:
-                del self.last_processed_ids[event_id]
+    def export_changed_state(self) -> dict:
+        """State of the events changed since the last call, for the state store checkpoint."""
+        changed, self.changed_events = self.changed_events, set()
+        return {
+            event_id: {**self.event_states[event_id].export(), "alerts": self.alert_history.export(event_id)}
+            for event_id in changed if event_id in self.event_states
+        }
 
-    def fetch_live_events(self) -> List[Dict]:
+    def restore_state(self, states: dict):
+        """Load the per event state saved by the state store, so a restart does not re-baseline every event."""
+        for event_id, state in states.items():
+            details = state.get("details", {})
+            event_state = self.event_states[event_id] = EventState.restore(state.get("last_processed", {}), details)
+            # Suspensions which are not over yet carry on
+            if event_state.buffer_stop is not None and event_state.buffer_stop > time.time():
+                self.suspensions.suspend(event_id, event_state.buffer_stop)
+            self.live_event_payloads.pop(event_id, None)
+            self.changed_events.add(event_id)
+            alerts = state.get("alerts", {})
+            # States saved before the alert history kept the last alerts in the details as last_<level>_alert
+            for key in details:
+                if key.startswith("last_") and key.endswith("_alert"):
+                    alerts.setdefault(key[len("last_"):-len("_alert")], details[key])
+            self.alert_history.restore(event_id, alerts)
+
+    async def fetch_sport_events(self, sport_id: int) -> List[Dict]:
         params = {
             'token': self.betsapi_token,
-            'sport_id': 1,
+            'sport_id': sport_id,
         }
-        response = requests.get(url=BET365_EVENTS_API_URL,
-                                params=params)
-        response.raise_for_status()
-        events_data = response.json()
-        return events_data.get("results", [])
-
-    def fetch_event_odds(self, event_id: str) -> dict:
+        # Polled every cycle, an unchanged inplay list is not downloaded again when the API answers 304 Not Modified
+        # and not decoded again when its body is the same
+        events_data, changed = await self.http_client.get_json_cached(self.events_api_url, params=params,
+                                                                      priority=EVENTS_REQUEST_PRIORITY,
+                                                                      cache_key=f"events_{sport_id}")
+        events = events_data.get("results", [])
+        if changed:
+            for event in events:
+                event.setdefault("sport_id", str(sport_id))
+        return events
+
+    async def fetch_live_events(self) -> List[Dict]:
+        # One inplay request per sport with enabled markets
+        sport_events = await asyncio.gather(*(self.fetch_sport_events(sport_id) for sport_id in self.markets.sports()))
+        return [event for events in sport_events for event in events]
+
+    async def fetch_event_odds(self, event_id: str, since_time: int = None, sport_id=DEFAULT_SPORT_ID) -> dict:
         params = {
             'token': self.betsapi_token,
             'event_id': event_id,
-            'odds_market': '2,3,5,6'  # Only the four types of lines we need
+            'odds_market': self.markets.odds_market(sport_id)  # Only the markets we alert on
         }
-        odds_response = requests.get(BET365_ODDS_API_URL, params=params)
-        odds_response.raise_for_status()
-        odds_data = odds_response.json()
+        if since_time is not None:
+            # Only data points added at or after this time, the ones we already have are skipped by id
+            params['since_time'] = since_time
+        async with self.odds_semaphore:
+            odds_data = await self.http_client.get_json(self.odds_api_url, params=params,
+                                                        priority=self.odds_priority(event_id))
         return odds_data.get("results", {}).get("odds", {})
 
-    async def detect_changes(self, event_id: str, line_type: str, data: list):
+    async def detect_changes(self, event_id: str, line_type: str, data: List[OddsPoint],
+                             odds_buffer: OddsHistoryBuffer = None):
         if not data:
             return []
 
@@ -77,110 +192,69 @@ class LineChangeDetector:
         changes = []
         recent_data = []
 
-        def get_float(x):
-            return float(x)
-
-        def check_open_odds(line_type_var, event_data_var):
-            """Will return -1 for dash data and 1 for valid data"""
-            if line_type_var == "1_2" or line_type_var == "1_5":
-                if event_data_var['home_od'] == '-' or event_data_var['away_od'] == '-':
-                    return -1
-            elif line_type_var == "1_3" or line_type_var == "1_6":
-                if event_data_var['over_od'] == '-' or event_data_var['under_od'] == '-':
-                    return -1
-                else:
-                    return 1
-            else:
-                return 1
-
         # Filter data up to the last processed ID for this event
-        last_processed_id = self.last_processed_ids.get(event_id, {}).get(line_type, {}).get("id", None)
-        if last_processed_id is None:
+        state = self.event_states.get(event_id)
+        if state is None:
+            state = self.event_states[event_id] = EventState()
+        market_state = state.markets.get(line_type)
+        if market_state is None:
             try:
-                self.last_processed_ids[event_id] = self.last_processed_ids.get(event_id, {})
-                self.last_processed_ids[event_id][line_type] = {
-                    "id": data[0]["id"],
-                    "value": statistics.fmean(map(get_float, data[0]['handicap'].split(',')))
-                    # This is to handle cases where values are like "1.0,1.5" where actual value is 1.25
-                }
+                state.markets[line_type] = MarketState(data[0].id, data[0].handicap)
+                self.changed_events.add(event_id)
             except Exception as e:
                 logging.error(f"{event_id} | {line_type} | {e}")
 
             return []
+        last_processed_id = market_state.last_id
+
+        # Long histories (after a restart, prelive events) are filtered and deduplicated as arrays instead
+        columns = None
+        if self.vectorized_detection and len(data) >= VECTORIZE_MIN_POINTS:
+            columns = LineColumns(data, odds_buffer)
 
         try:
             new_data = []
             # We ignore the last data point of the data set as it would be discarded naturally in this logic
             # This loop is in descending order from latest data point to start data point
-            for i in range(1, len(data) - 1):
-                if statistics.fmean(map(get_float, data[i]['handicap'].split(','))) != statistics.fmean(
-                        map(get_float, data[i - 1]['handicap'].split(','))):
-                    continue
-                elif check_open_odds(line_type, data[i]) == -1:
-                    continue
-                elif check_open_odds(line_type, data[i - 1]) == -1:
-                    continue
-                else:
-                    new_data.append(data[i - 1])
-
-        except Exception as e:
-            logging.error(f"In new logic for valid points | {event_id} | {line_type} | {e}")
-            pass
-
-        # Remove data points with no odds data now to avoid false alerts
-        # This is not needed after putting the above logic block but still keeping for safety
-        try:
-            clean_odds_data = []
-
-            for event_data in new_data:
-                if line_type == "1_2" or line_type == "1_5":
-                    if event_data['home_od'] == '-' or event_data['away_od'] == '-':
+            # A data point is only valid when its previous data point has the same line and both have open odds,
+            # this also removes all the data points with no odds data ('-') to avoid false alerts
+            if columns is not None:
+                new_data = columns.valid_points()
+            else:
+                for i in range(1, len(data) - 1):
+                    if data[i].handicap != data[i - 1].handicap:
                         continue
-                    else:
-                        clean_odds_data.append(event_data)
-                elif line_type == "1_3" or line_type == "1_6":
-                    if event_data['over_od'] == '-' or event_data['under_od'] == '-':
+                    elif not data[i].odds_open:
+                        continue
+                    elif not data[i - 1].odds_open:
                         continue
                     else:
-                        clean_odds_data.append(event_data)
-
-            temp_data = list(clean_odds_data)
-            new_data = temp_data
+                        new_data.append(data[i - 1])
 
         except Exception as e:
-            logging.error(f"In Cleaning Odds Data | {event_id} | {line_type} | {e}")
+            logging.error(f"In new logic for valid points | {event_id} | {line_type} | {e}")
+            pass
 
         # Clean data by removing consecutive duplicate values
         try:
             cleaned_data = [new_data[-1]]
-            last_value = statistics.fmean(
-                map(get_float, (new_data[-1]['handicap'].replace("+", '')).split(',')))
-
-            for data_value in reversed(new_data[:-1]):
-                if statistics.fmean(
-                        map(get_float, data_value['handicap'].split(','))) != last_value:
-                    cleaned_data.append(data_value)
-                    last_value = statistics.fmean(
-                        map(get_float, data_value['handicap'].split(',')))
-                # adding the below to use latest value appearance rather than the first value appearance
-                # Refresh concept
-                else:
-                    cleaned_data[-1] = data_value
+            last_value = new_data[-1].handicap
+
+            if columns is not None:
+                cleaned_data = columns.cleaned_points()
+            else:
+                for data_value in reversed(new_data[:-1]):
+                    if data_value.handicap != last_value:
+                        cleaned_data.append(data_value)
+                        last_value = data_value.handicap
+                    # adding the below to use latest value appearance rather than the first value appearance
+                    # Refresh concept
+                    else:
+                        cleaned_data[-1] = data_value
 
-            # for entry in reversed(cleaned_data):
-            # for entry in reversed(new_data):
             for entry in new_data:
-                # if entry['id'] == last_processed_id:
-                if entry['id'] <= last_processed_id:
+                if entry.id <= last_processed_id:
                     break
-
-                # Again this to skip the false positive cases where odds are '-'
-                if line_type == "1_2" or line_type == "1_5":
-                    if entry['home_od'] == '-' or entry['away_od'] == '-':
-                        continue
-                elif line_type == "1_3" or line_type == "1_6":
-                    if entry['over_od'] == '-' or entry['under_od'] == '-':
-                        continue
                 recent_data.append(entry)
 
             if not recent_data:
@@ -190,29 +264,45 @@ class LineChangeDetector:
         except Exception as e:
             logging.error(f"In Cleaning Duplicates | {event_id} | {line_type} | {e}")
 
-        last_processed_value = self.last_processed_ids.get(event_id, {}).get(line_type, {}).get("value", None)
+        if not recent_data:
+            return changes
+
+        last_processed_value = market_state.last_value
+        # The cursor moves on to the recent data points
+        self.changed_events.add(event_id)
+
+        # the following is to bypass the data points
+        # which were within the suspension window of a penalty or red card
+        # Only the first odds after a suspension have such data points, the event is not fetched during the window
+        buffer_stop = state.buffer_stop
+        if buffer_stop is not None and cleaned_data and cleaned_data[0].add_time < buffer_stop:
+            cleaned_data = [line_data for line_data in cleaned_data if line_data.add_time >= buffer_stop]
+        if buffer_stop is not None and recent_data[-1].add_time < buffer_stop:
+            recent_data = [entry for entry in recent_data if entry.add_time >= buffer_stop]
+
+        # Start points of a move for every recent entry, slides forward with the entries (oldest first)
+        market = self.markets.get(line_type)
+        window = None
+        if columns is not None:
+            window = ColumnLineWindow.build(cleaned_data, market.window, [entry.add_time for entry in recent_data])
+        if window is None:
+            window = SlidingLineWindow(cleaned_data, market.window)
 
         for entry in reversed(recent_data):
 
-            # the following is to bypass the data points
-            # which were within the 150 seconds range from a penalty or red card
-            current_data_time = entry.get("add_time", None)
-            buffer_stop = self.live_event_details.get(event_id, {}).get("buffer_stop", None)
-            if current_data_time is not None and buffer_stop is not None:
-                if current_data_time < buffer_stop:
-                    continue
-
             changes_data = {}
-            entry_value = statistics.fmean(
-                map(get_float, entry['handicap'].split(',')))
+            entry_value = entry.handicap
             if entry_value != last_processed_value:
+                # Remember when the line last moved, events with recent moves get their odds fetched first
+                state.line_moved_at = entry.add_time
+                self.poll_scheduler.record_line_move(event_id, line_type)
 
                 # This is to capture game time from odds api rather than events api
                 # to get specific game data which the alert is for.
                 try:
-                    game_time = entry['time_str']
+                    game_time = entry.raw['time_str']
                 except:
-                    game_time = self.live_event_details.get(event_id, {}).get('game_time', '')
+                    game_time = state.game_time
 
                 if game_time is None:
                     game_time = "Prelive"
@@ -221,16 +311,8 @@ class LineChangeDetector:
 
                 # This is to capture goals data from odds api rather than inplay events api and to avoid processing
                 # fake alerts in case of goals.
-                last_processed_goals = self.last_processed_ids.get(event_id, {}).get("goals", None)
-                try:
-                    current_goals_data = entry.get('ss', '-')
-                    if current_goals_data is None:
-                        current_goals = last_processed_goals
-                    else:
-                        current_goals = current_goals_data.split('-')
-                except Exception as e:
-                    logging.error(f"In Goals Data | {event_id} | {line_type} | {e}")
-                    continue
+                last_processed_goals = state.last_goals
+                current_goals = entry.goals if entry.goals is not None else last_processed_goals
 
                 if current_goals != last_processed_goals:
                     # logging.info(f"Goal detected within running data | "
@@ -240,206 +322,220 @@ class LineChangeDetector:
 
                     continue
 
-                for line_data in reversed(cleaned_data):
-                    # This to skip the false positive cases where odds are '-'
-                    if line_type == "1_2" or line_type == "1_5":
-                        if line_data['home_od'] == '-' or line_data['away_od'] == '-':
-                            continue
-                    elif line_type == "1_3" or line_type == "1_6":
-                        if line_data['over_od'] == '-' or line_data['under_od'] == '-':
-                            continue
-
-                    # the following is to bypass the data points
-                    # which were within the 150 seconds range from a penalty or red card
-                    line_data_time = line_data.get("add_time", None)
-                    if line_data_time is not None and buffer_stop is not None:
-                        if line_data_time < buffer_stop:
-                            continue
-
-                    time_difference = int(entry['add_time']) - int(line_data['add_time'])
-                    if time_difference <= 0:
-                        continue
-                    elif time_difference > 150:
-                        break
-                    current_handicap = statistics.fmean(map(get_float, entry['handicap'].split(',')))
-                    next_handicap = statistics.fmean(map(get_float, line_data['handicap'].split(',')))
+                # Only walks the points of the last 150 seconds, and only when one of them is far enough for an alert
+                window.advance(entry.add_time)
+                for line_data in window.candidates(entry.handicap, market.min_change):
+                    time_difference = entry.add_time - line_data.add_time
+                    current_handicap = entry.handicap
+                    next_handicap = line_data.handicap
                     handicap_change = abs(current_handicap - next_handicap)
 
                     try:
-                        change_type_flag = None
-                        if time_difference <= 150:
-
-                            print(event_id, line_type, "Handicap Change: ", handicap_change, time_difference)
-                            if 0.5 <= handicap_change < 0.75:
-                                change_type_flag = "SOFT"
-                            elif 0.75 <= handicap_change < 1.0:
-                                change_type_flag = "MEDIUM"
-                            elif handicap_change >= 1.0:
-                                change_type_flag = "HARD"
-                            else:
-                                continue
-                            print(change_type_flag)
-                            try:
-                                if entry['ss'] != line_data['ss']:
-                                    home_team = self.live_event_details.get(event_id, {}).get('home_team', '')
-                                    away_team = self.live_event_details.get(event_id, {}).get('away_team', '')
-                                    await logging_bot.sendMessage(
-                                        text=f"{home_team} v {away_team} - {change_type_flag} -\n"
-                                             f"{next_handicap} -> {current_handicap}\n"
-                                             f"Goal detected within running data while alert "
-                                             f"detection\n"
-                                             f"{line_data['ss']} | {entry['ss']} \n"
-                                             f"Current Data - {game_time}' {entry}\n"
-                                             f"https://betsapi.com/rs/bet365/" \
-                                             f"{event_id}/{home_team.replace(' ', '-')}-v-{away_team.replace(' ', '-')}"
-                                        ,
-                                        chat_id=LOGS_CHANNEL,
-                                        disable_web_page_preview=True)
-                                    logging.info(f"Goal detected within running data while alert detection | "
-                                                 f"{event_id} |"
-                                                 f"{line_data['ss']} | {entry['ss']} |"
-                                                 f"Current Data - {game_time}' {entry}")
-                                    continue
-                            except Exception as e:
-                                logging.error(f"Within alert - goal detection: {e}")
+                        change_type_flag = classify_change(handicap_change, market.thresholds)
+                        logging.debug("Handicap Change | %s | %s | %s | %s | %s", event_id, line_type,
+                                      handicap_change, time_difference, change_type_flag)
+                        if change_type_flag is None:
+                            continue
+                        try:
+                            if entry.ss != line_data.ss:
+                                home_team = state.home_team
+                                away_team = state.away_team
+                                self.alert_outbox.enqueue(
+                                    "logs",
+                                    text=f"{home_team} v {away_team} - {change_type_flag} -\n"
+                                         f"{next_handicap} -> {current_handicap}\n"
+                                         f"Goal detected within running data while alert "
+                                         f"detection\n"
+                                         f"{line_data.ss} | {entry.ss} \n"
+                                         f"Current Data - {game_time}' {entry}\n"
+                                         f"https://betsapi.com/rs/bet365/" \
+                                         f"{event_id}/{home_team.replace(' ', '-')}-v-{away_team.replace(' ', '-')}"
+                                    ,
+                                    chat_id=self.logs_channel,
+                                    disable_web_page_preview=True)
+                                logging.info("Goal detected within running data while alert detection | "
+                                             "%s |%s | %s |Current Data - %s' %s",
+                                             event_id, line_data.ss, entry.ss, game_time, entry)
                                 continue
-                                # pass
-                            if change_type_flag is not None:
-                                if changes_data.get(change_type_flag, None) is None:
-
-                                    home_team = self.live_event_details.get(event_id, {}).get('home_team', '')
-                                    away_team = self.live_event_details.get(event_id, {}).get('away_team', '')
-                                    if game_time != "Prelive":
-                                        change_msg = f"⚽ {self.live_event_details.get(event_id, {}).get('league', '')}\n" \
-                                                     f'⏱ {game_time} ' \
-                                                     f"{home_team} " \
-                                                     f"{'-'.join(self.live_event_details.get(event_id, {}).get('goals', []))} " \
-                                                     f"{away_team}\n" \
-                                                     f"<b>{self.line_types[line_type]}</b> " \
-                                                     f"from <b>{next_handicap}</b> -> <b>{current_handicap}</b> " \
-                                                     f"in {time_difference}s \n" \
-                                                     f"https://betsapi.com/rs/bet365/" \
-                                                     f"{event_id}/{home_team.replace(' ', '-')}" \
-                                                     f"-v-" \
-                                                     f"{away_team.replace(' ', '-')}"
-                                    else:
-                                        change_msg = f"Prelive🔜\n" \
-                                                     f"⚽ {self.live_event_details.get(event_id, {}).get('league', '')}\n" \
-                                                     f'⏱ ' \
-                                                     f"{home_team} " \
-                                                     f"{'-'.join(self.live_event_details.get(event_id, {}).get('goals', []))} " \
-                                                     f"{away_team}\n" \
-                                                     f"<b>{self.line_types[line_type]}</b> " \
-                                                     f"from <b>{next_handicap}</b> -> <b>{current_handicap}</b> " \
-                                                     f"in {time_difference}s \n" \
-                                                     f"https://betsapi.com/rs/bet365/" \
-                                                     f"{event_id}/{home_team.replace(' ', '-')}" \
-                                                     f"-v-" \
-                                                     f"{away_team.replace(' ', '-')}"
-
-
-                                    changes_data[change_type_flag] = True
-
-                                    # The following is the range filter based on previous alert data
-
-                                    try:
-                                        previous_alert_data = self.live_event_details.get(event_id, {}).get(
-                                            f"last_{change_type_flag}_alert", None)
-                                        if previous_alert_data is not None:
-                                            current_direction = 1 if current_handicap - next_handicap > 0 else -1
-                                            if current_direction == previous_alert_data[2]:
-                                                if current_direction == 1:
-                                                    if previous_alert_data[0] <= next_handicap < previous_alert_data[1]:
-                                                        logging.info(f"Alert Stopped at Range Filter | "
-                                                                     f"from <b>{next_handicap}</b>->"
-                                                                     f"<b>{current_handicap}</b> | "
-                                                                     f"{previous_alert_data}")
-                                                        log_message = f"Alert Stopped at Range Filter \n\n" \
-                                                                      f"Previous Data : {previous_alert_data} \n\n" \
-                                                                      f"{change_msg}"
-                                                        await logging_bot.sendMessage(text=log_message,
-                                                                                      chat_id=LOGS_CHANNEL,
-                                                                                      parse_mode='HTML',
-                                                                                      disable_web_page_preview=True
-                                                                                      )
-
-                                                        continue
-
-                                                if current_direction == -1:
-                                                    if previous_alert_data[0] >= next_handicap > previous_alert_data[1]:
-                                                        logging.info(f"Alert Stopped at Range Filter | "
-                                                                     f"from <b>{next_handicap}</b>->"
-                                                                     f"<b>{current_handicap}</b> | "
-                                                                     f"{previous_alert_data}")
-                                                        log_message = f"Alert Stopped at Range Filter \n\n" \
-                                                                      f"Previous Data : {previous_alert_data} \n\n" \
-                                                                      f"{change_msg}"
-                                                        await logging_bot.sendMessage(text=log_message,
-                                                                                      chat_id=LOGS_CHANNEL,
-                                                                                      parse_mode='HTML',
-                                                                                      disable_web_page_preview=True
-                                                                                      )
-                                                        continue
-
-                                    except Exception as e:
-                                        logging.error(f"In Range Filter | {e} | \n{change_msg}")
-
-                                    await line_change_bot.sendMessage(text=change_msg,
-                                                                      chat_id=self.alerts_channels.get(change_type_flag,
-                                                                                                       LOGS_CHANNEL),
-                                                                      parse_mode='HTML',
-                                                                      disable_web_page_preview=True)
-
-                                    # This is to update the last alert details to maintain range filter
-                                    self.live_event_details[event_id][
-                                        f"last_{change_type_flag}_alert"] = (next_handicap,
-                                                                             current_handicap,
-                                                                             1 if current_handicap - next_handicap > 0
-                                                                             else -1)
-
-                                    changes.append({
-                                        "event_id": event_id,
-                                        "change_type": change_type_flag,
-                                        "handicap_change": handicap_change,
-                                        "time_difference": time_difference,
-                                        "from": entry,
-                                        "to": line_data
-                                    })
-                                    logging.info(
-                                        f"Alert Sent | "
-                                        f"{change_type_flag}| {entry} | {line_data} | {cleaned_data} | {recent_data}")
+                        except Exception as e:
+                            logging.error(f"Within alert - goal detection: {e}")
+                            continue
+                            # pass
+                        if change_type_flag is not None:
+                            if changes_data.get(change_type_flag, None) is None:
+
+                                home_team = state.home_team
+                                away_team = state.away_team
+                                prelive = "Prelive🔜\n" if game_time == "Prelive" else ""
+                                clock = f"{game_time} " if game_time != "Prelive" else ""
+                                alert = Alert(event_id, line_type, change_type_flag,
+                                              market.severity[change_type_flag],
+                                              market.channels.get(change_type_flag) or
+                                              self.alerts_channels.get(change_type_flag, self.logs_channel),
+                                              header=f"{prelive}⚽ {state.league}\n"
+                                                     f"⏱ {clock}{home_team} "
+                                                     f"{'-'.join(state.goals)} {away_team}\n",
+                                              line=f"<b>{self.line_types[line_type]}</b> "
+                                                   f"from <b>{next_handicap}</b> -> <b>{current_handicap}</b> "
+                                                   f"in {time_difference}s \n",
+                                              link=f"https://betsapi.com/rs/bet365/"
+                                                   f"{event_id}/{home_team.replace(' ', '-')}"
+                                                   f"-v-"
+                                                   f"{away_team.replace(' ', '-')}",
+                                              from_value=next_handicap, to_value=current_handicap,
+                                              move_id=entry.id)
+                                change_msg = alert.text()
+
+                                changes_data[change_type_flag] = True
+
+                                # The following is the range filter based on previous alert data
+                                try:
+                                    previous_alert_data = self.alert_history.in_range(event_id, change_type_flag,
+                                                                                      next_handicap, current_handicap)
+                                    # Alerts waiting to be merged into one message count as sent
+                                    if previous_alert_data is None and self.alert_aggregator is not None:
+                                        previous_alert_data = self.alert_aggregator.in_range(
+                                            event_id, change_type_flag, next_handicap, current_handicap)
+                                    if previous_alert_data is not None:
+                                        logging.info("Alert Stopped at Range Filter | "
+                                                     "from <b>%s</b>-><b>%s</b> | %s",
+                                                     next_handicap, current_handicap, previous_alert_data)
+                                        log_message = f"Alert Stopped at Range Filter \n\n" \
+                                                      f"Previous Data : {previous_alert_data} \n\n" \
+                                                      f"{change_msg}"
+                                        self.alert_outbox.enqueue("logs", text=log_message,
+                                                                  chat_id=self.logs_channel,
+                                                                  parse_mode='HTML',
+                                                                  disable_web_page_preview=True)
+                                        continue
+
+                                except Exception as e:
+                                    logging.error(f"In Range Filter | {e} | \n{change_msg}")
+
+                                # Alerts of the same event are merged into one message when aggregation is on,
+                                # they go into the alert history for the range filter once they are sent
+                                if self.alert_aggregator is not None:
+                                    self.alert_aggregator.add(alert)
+                                else:
+                                    self.alert_outbox.enqueue("alerts", text=change_msg, chat_id=alert.chat_id,
+                                                              parse_mode='HTML',
+                                                              disable_web_page_preview=True)
+                                    self.record_alert(alert)
+
+                                changes.append({
+                                    "event_id": event_id,
+                                    "change_type": change_type_flag,
+                                    "handicap_change": handicap_change,
+                                    "time_difference": time_difference,
+                                    "from": entry,
+                                    "to": line_data
+                                })
+                                logging.info("Alert Sent | %s| %s | %s", change_type_flag, entry, line_data)
+                                # The full odds lists are only formatted when debug logging is on
+                                logging.debug("Alert Data | %s | %s | %s", event_id, cleaned_data, recent_data)
                     except Exception as e:
                         logging.error(f"In Detecting Change | {event_id} | {line_type} | {e}")
 
-                self.last_processed_ids[event_id]["goals"] = current_goals
+                state.last_goals = current_goals
             last_processed_value = entry_value
-            self.last_processed_ids[event_id][line_type] = {
-                "id": entry.get("id", None),
-                "value": last_processed_value
-            }
+            market_state.last_id = entry.id
+            market_state.last_value = last_processed_value
 
         return changes
 
-    def get_blacklist(self):
-        """Retrieve the blacklist."""
-        return self.load_blacklist()
+    def odds_priority(self, event_id: str) -> int:
+        """Request priority of an event, lines moved recently first, then in-play and then prelive events."""
+        state = self.event_states.get(event_id)
+        if state is None:
+            return INPLAY_EVENT_PRIORITY
+        if state.line_moved_at is not None and time.time() - state.line_moved_at < HOT_EVENT_SECONDS:
+            return HOT_EVENT_PRIORITY
+        if state.game_time != "Prelive":
+            return INPLAY_EVENT_PRIORITY
+        return PRELIVE_EVENT_PRIORITY
+
+    def game_time(self, event_id: str):
+        state = self.event_states.get(event_id)
+        return state.game_time if state is not None else None
+
+    async def apply_event_odds(self, event: dict, odds_data: dict):
+        """Run detection for the odds data of an event, a full poll or an update pushed by a streaming feed."""
+        event_id = event["id"]
+        sport_id = event.get("sport_id", DEFAULT_SPORT_ID)
+
+        # Detect changes for the event, each odds data point is parsed once here for all the detection passes
+        odds_buffers = self.odds_buffers.setdefault(event_id, {}) if self.incremental_odds else None
+        for market in self.markets.for_sport(sport_id):
+            line_type = market.key
+            try:
+                if self.incremental_odds:
+                    odds_buffer = odds_buffers.get(line_type)
+                    if odds_buffer is None:
+                        odds_buffer = odds_buffers[line_type] = OddsHistoryBuffer(line_type, market.window,
+                                                                                  market.odds_fields,
+                                                                                  self.vectorized_detection)
+                    odds_buffer.extend(odds_data.get(line_type, []))
+                    odds_points = odds_buffer.latest_first()
+                else:
+                    odds_buffer = None
+                    odds_points = parse_odds_points(line_type, odds_data.get(line_type, []), market.odds_fields)
+
+                detect_started_at = time.perf_counter()
+                changes = await self.detect_changes(event_id, line_type, odds_points, odds_buffer)
+                if self.metrics is not None:
+                    self.metrics.observe("detect_changes_seconds", time.perf_counter() - detect_started_at,
+                                         line_type=line_type)
+
+                if self.incremental_odds:
+                    state = self.event_states.get(event_id)
+                    market_state = state.markets.get(line_type) if state is not None else None
+                    odds_buffer.trim(market_state.last_id if market_state is not None else None)
+            except Exception as e:
+                logging.error(f"{event} | {line_type} | {e}")
 
+        if self.alert_aggregator is not None:
+            self.alert_aggregator.flush(event_id)
 
-    def load_blacklist(self):
-        """Load the blacklist from the JSON file."""
-        if not os.path.exists(BLACKLIST_FILE):
-            return set()
-        with open(BLACKLIST_FILE, "r") as file:
-            return set(json.load(file))
+    async def process_event_odds(self, event: dict):
+        event_id = event["id"]
+        sport_id = event.get("sport_id", DEFAULT_SPORT_ID)
 
+        since_time = None
+        if self.incremental_odds:
+            odds_buffers = self.odds_buffers.setdefault(event_id, {})
+            latest_times = [odds_buffer.latest_time for odds_buffer in odds_buffers.values() if odds_buffer.points]
+            since_time = min(latest_times) if latest_times else None
 
-    async def process(self):
+        # Fetch odds data for the event
+        try:
+            odds_data = await self.fetch_event_odds(event_id, since_time, sport_id)
+        except CircuitOpenError as e:
+            # Only this event's detection is skipped, it stays due and is fetched again once the api recovers
+            logging.debug("Odds Fetch Skipped | %s | %s", event_id, e)
+            return
+        except Exception as e:
+            logging.error(f"In Fetching Odds | {event_id} | {e}")
+            # A failing event is retried later and later instead of on every cycle, each try costs quota
+            self.poll_scheduler.schedule_retry(event_id, self.game_time(event_id))
+            return
 
-        # Fetch all live events
-        live_events = self.fetch_live_events()
+        await self.apply_event_odds(event, odds_data)
+
+        self.poll_scheduler.schedule(event_id, self.game_time(event_id))
+
+    async def process(self, live_events: List[Dict] = None):
+
+        # Fetch all live events, unless a sharding coordinator already fetched this worker's share of them
+        if live_events is None:
+            live_events = await self.fetch_live_events()
+
+        # Lift the suspensions which are over
+        resumed = self.suspensions.advance()
+        if resumed:
+            logging.info("Suspensions Over | %s", resumed)
 
         # Fetch blacklisted leagues
-        blacklist = self.get_blacklist()
+        blacklist = self.blacklist.get() if self.blacklist is not None else frozenset()
 
         if not live_events:
             logging.info("No live events found.")
@@ -447,6 +543,7 @@ class LineChangeDetector:
 
         event_count = 0
         all_events = []
+        odds_events = []
         for event in live_events:
 
             event_id = event.get("id")
@@ -465,116 +562,72 @@ class LineChangeDetector:
             if league_name.lower() in blacklist:
                 continue
 
-            # Moving away from 2` filter to considering pre - live data too
-            try:
-                game_time = event.get("timer", {}).get("tm", None)
-                # if int(game_time) < 2 :
-                if game_time is None:
-                    game_time = 'Prelive'
-            except Exception as e:
-                logging.error(f"In Getting Game Time | {event} | e")
-                game_time = None
+            # Details are only rebuilt for events whose payload changed since the last cycle
+            state = self.event_states.get(event_id)
+            previous_payload = self.live_event_payloads.get(event_id)
+            payload_changed = (previous_payload is not event and previous_payload != event) or state is None
+            if payload_changed:
+                self.live_event_payloads[event_id] = event
 
-            try:
-                # Information to be captured and stored here - Id, Name, League, Time, Red Card, Penalties, Goals
-                self.live_event_details[event["id"]] = self.live_event_details.get(event["id"], {})
-                self.live_event_details[event["id"]]["home_team"] = event.get("home", {}).get("name", None)
-                self.live_event_details[event["id"]]["away_team"] = event.get("away", {}).get("name", None)
-                self.live_event_details[event["id"]]["league"] = league_name
-                self.live_event_details[event["id"]]["game_time"] = game_time
-                self.live_event_details[event["id"]]["goals"] = event.get("stats", {}).get("goals", None)
-                self.live_event_details[event["id"]]["penalties"] = event.get("stats", {}).get("penalties", None)
-                self.live_event_details[event["id"]]["red_cards"] = event.get("stats", {}).get("redcards", None)
+                # Moving away from 2` filter to considering pre - live data too
+                try:
+                    game_time = event.get("timer", {}).get("tm", None)
+                    # if int(game_time) < 2 :
+                    if game_time is None:
+                        game_time = 'Prelive'
+                except Exception as e:
+                    logging.error(f"In Getting Game Time | {event} | e")
+                    game_time = None
 
-            except Exception as e:
-                logging.error(f"In Updating Live Event Details | {event} | {e}")
-
-            # This is to avoid processing this event if there was a penalty or red card 150 seconds before now.
-            buffer_stop = self.live_event_details.get(event_id, {}).get("buffer_stop", None)
-            current_time = event.get("time", None)
-            # logging.info(f"{current_time} | {buffer_stop} | {event}")
-            if buffer_stop is not None and current_time is not None:
-                if int(current_time) < int(buffer_stop):
-                    continue
+                if state is None:
+                    state = self.event_states[event_id] = EventState()
+                try:
+                    # Information to be captured and stored here - Id, Name, League, Time, Red Card, Penalties, Goals
+                    state.home_team = event.get("home", {}).get("name", None)
+                    state.away_team = event.get("away", {}).get("name", None)
+                    state.league = league_name
+                    state.game_time = game_time
+                    stats = event.get("stats", {})
+                    state.goals = stats.get("goals", None)
+                    state.penalties = stats.get("penalties", None)
+                    state.red_cards = stats.get("redcards", None)
+                    self.changed_events.add(event_id)
 
-            event_count += 1
+                except Exception as e:
+                    logging.error(f"In Updating Live Event Details | {event} | {e}")
 
-            # Store last goals, penalties, red cards data
-            last_processed_goals = self.last_processed_ids.get(event_id, {}).get("goals", None)
-            last_processed_penalties = self.last_processed_ids.get(event_id, {}).get("penalties", None)
-            last_processed_red_cards = self.last_processed_ids.get(event_id, {}).get("red_cards", None)
+            # Events suspended after a penalty or red card are neither fetched nor checked until their window is over
+            if self.suspensions.is_suspended(event_id):
+                continue
 
-            self.last_processed_ids[event_id] = self.last_processed_ids.get(event_id, {})
+            event_count += 1
 
             # Don't process changes in the cases of Goals, Penalties and Red Cards to avoid false alerts.
-            continue_flag = False
-            if last_processed_goals != self.live_event_details.get(event_id, {}).get("goals", None):
-                # if last_processed_goals is None:
-                self.last_processed_ids[event_id]["goals"] = self.live_event_details.get(event_id, {}).get(
-                    "goals", None)
-                # if last_processed_goals is not None and self.live_event_details.get(event_id, {}).get(
-                #         "goals", None) is not None:
-                #     print("goal")
-                # await logger_bot.sendMessage(text="New Goal Detected at new api hit, skipping this data set.",
-                #                              chat_id=only_logs_channel)
-                continue_flag = True
-            if last_processed_penalties != self.live_event_details.get(event_id, {}).get("penalties", None):
-                self.last_processed_ids[event_id]["penalties"] = self.live_event_details.get(event_id, {}).get(
-                    "penalties", None)
-                if last_processed_penalties is not None and self.live_event_details.get(event_id, {}).get(
-                        "penalties", None) is not None:
-                    # this is to avoid processing a event 150 sec from a penalty detection
-                    penalty_time = event.get('time', None)
-                    self.live_event_details[event_id]["buffer_stop"] = int(
-                        penalty_time) + 150 if penalty_time is not None else None
-                    logging.info(f"New Penalty Detected, skipping this data set.\n"
-                                 f"{self.live_event_details.get(event_id, {}.get('home_team', None))}"
-                                 f" v "
-                                 f"{self.live_event_details.get(event_id, {}).get('away_team', None)}\n"
-                                 f"{self.live_event_details.get(event_id, {}).get('game_time', None)}'")
-                    await logging_bot.sendMessage(text=f"New Penalty Detected, skipping this data set "
-                                                       f"adn the event for next 150 seconds.\n"
-                                                       f"{self.live_event_details.get(event_id, {}.get('home_team', None))}"
-                                                       f" v "
-                                                       f"{self.live_event_details.get(event_id, {}).get('away_team', None)}\n"
-                                                       f"{self.live_event_details.get(event_id, {}).get('game_time', None)}'",
-                                                  chat_id=LOGS_CHANNEL)
-                continue_flag = True
-            if last_processed_red_cards != self.live_event_details.get(event_id, {}).get("red_cards", None):
-                self.last_processed_ids[event_id]["red_cards"] = self.live_event_details.get(event_id, {}).get(
-                    "red_cards", None)
-                if last_processed_red_cards is not None and self.live_event_details.get(event_id, {}).get(
-                        "red_cards", None) is not None:
-                    # This is to stop processing a event 150 secs from red_card_detection
-                    red_card_time = event.get('time', None)
-                    self.live_event_details[event_id]["buffer_stop"] = int(
-                        red_card_time) + 150 if red_card_time is not None else None
-                    logging.info(f"New New Red Card Detected, skipping this data set.\n"
-                                 f"{self.live_event_details.get(event_id, {}.get('home_team', None))}"
-                                 f" v "
-                                 f"{self.live_event_details.get(event_id, {}).get('away_team', None)}\n"
-                                 f"{self.live_event_details.get(event_id, {}).get('game_time', None)}'")
-                    await logging_bot.sendMessage(text=f"New Red Card Detected, skipping this data set "
-                                                       f"and this event for next 150 seconds.\n"
-                                                       f"{self.live_event_details.get(event_id, {}.get('home_team', None))}"
-                                                       f" v "
-                                                       f"{self.live_event_details.get(event_id, {}).get('away_team', None)}\n"
-                                                       f"{self.live_event_details.get(event_id, {}).get('game_time', None)}'",
-                                                  chat_id=LOGS_CHANNEL)
-                continue_flag = True
-
-            if continue_flag is True:
+            changed, incidents = self.suspensions.detect(event_id, state)
+            if changed:
+                self.changed_events.add(event_id)
+            for incident in incidents:
+                if incident.until is None:
+                    continue
+                incident_name = INCIDENT_NAMES[incident.kind]
+                suspension_seconds = self.suspensions.windows[incident.kind]
+                logging.info(f"New {incident_name} Detected, skipping this data set.\n"
+                             f"{state.home_team} v {state.away_team}\n"
+                             f"{state.game_time}'")
+                self.alert_outbox.enqueue("logs", text=f"New {incident_name} Detected, skipping this data set "
+                                                       f"and the event for next {suspension_seconds:g} seconds.\n"
+                                                       f"{state.home_team} v {state.away_team}\n"
+                                                       f"{state.game_time}'",
+                                          chat_id=self.logs_channel)
+            if changed:
                 continue
 
-            # Fetch odds data for the event
-            odds_data = self.fetch_event_odds(event_id)
+            odds_events.append(event)
 
-            # Detect changes for the event
-            for line_type in self.line_types.keys():
-                try:
-                    changes = await self.detect_changes(event_id, line_type, odds_data.get(line_type, []))
-                except Exception as e:
-                    logging.error(f"{event} | {line_type} | {e}")
+        # The feed source delivers the odds of the eligible events, by polling the due ones or from a push feed
+        await self.feed_source.cycle(self, odds_events)
+        if self.alert_aggregator is not None:
+            self.alert_aggregator.flush()
 
         return event_count, all_events
 
@@ -583,38 +636,219 @@ class LineChangeDetector:
 if __name__ == "__main__":
     load_dotenv()
 
+    # Logs are written by a background thread, rotated at LOG_MAX_BYTES or on the LOG_ROTATE_WHEN schedule
+    LOG_CONFIG = {
+        "log_file": os.getenv("LOG_FILE") or "bot.log",
+        "level": os.getenv("LOG_LEVEL") or "INFO",
+        "max_bytes": int(os.getenv("LOG_MAX_BYTES") or 50 * 1024 * 1024),
+        "backup_count": int(os.getenv("LOG_BACKUP_COUNT") or 5),
+        "rotate_when": os.getenv("LOG_ROTATE_WHEN")
+    }
+    setup_logging(**LOG_CONFIG)
+
     BET365_EVENTS_API_URL = os.getenv("BET365_EVENTS_API_URL")
     BET365_ODDS_API_URL = os.getenv("BET365_ODDS_API_URL")
     BET365_API_TOKEN = os.getenv("BET365_API_TOKEN")
-    detector = LineChangeDetector(events_api_url=BET365_EVENTS_API_URL,
-                                  odds_api_url=BET365_ODDS_API_URL,
-                                  betsapi_token=BET365_API_TOKEN)
+    ODDS_FETCH_CONCURRENCY = int(os.getenv("ODDS_FETCH_CONCURRENCY") or 20)
+    INCREMENTAL_ODDS = os.getenv("INCREMENTAL_ODDS", "1") != "0"
+    BETSAPI_REQUESTS_PER_HOUR = int(os.getenv("BETSAPI_REQUESTS_PER_HOUR") or 195000)
+    MIN_CYCLE_SECONDS = float(os.getenv("MIN_CYCLE_SECONDS") or 1)
+    # Longest wait between two cycles after failed cycles in a row
+    MAX_BACKOFF_SECONDS = float(os.getenv("MAX_BACKOFF_SECONDS") or 60)
+    STATE_DB_FILE = os.getenv("STATE_DB_FILE", "detector_state.db")
+    # Set RECORD_DIR to record every BetsAPI response for replay.py and benchmark.py
+    RECORD_DIR = os.getenv("RECORD_DIR")
+    # Set METRICS_PORT to serve the hot path timing histograms on http://127.0.0.1:<port>/metrics
+    METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+    INPLAY_POLL_SECONDS = float(os.getenv("INPLAY_POLL_SECONDS") or 5)
+    PRELIVE_POLL_SECONDS = float(os.getenv("PRELIVE_POLL_SECONDS") or 30)
+    # Set MARKETS_FILE to a JSON list of markets to alert on other sports and markets (see markets.py)
+    MARKETS_FILE = os.getenv("MARKETS_FILE")
+    # Set DETECTOR_WORKERS to split the events over that many worker processes (see sharding.py), to change it
+    # while running edit it in .env and send the bot SIGHUP
+    DETECTOR_WORKERS = int(os.getenv("DETECTOR_WORKERS") or 0)
+    # Set ODDS_STREAM_URL to a server-sent events feed of odds updates to detect on every update instead of polling
+    # the odds api, it runs in a single process on the incremental odds buffers (see feed_source.py)
+    ODDS_STREAM_URL = os.getenv("ODDS_STREAM_URL") or None
+    if ODDS_STREAM_URL is not None:
+        if DETECTOR_WORKERS:
+            logging.warning("ODDS_STREAM_URL is set, DETECTOR_WORKERS is ignored")
+            DETECTOR_WORKERS = 0
+        INCREMENTAL_ODDS = True
+    # Events missing from the live events keep their state for EVENT_GRACE_SECONDS, up to MAX_TRACKED_EVENTS events
+    EVENT_GRACE_SECONDS = float(os.getenv("EVENT_GRACE_SECONDS") or 120)
+    MAX_TRACKED_EVENTS = int(os.getenv("MAX_TRACKED_EVENTS") or 20000)
+    # Alerts of an event within ALERT_COALESCE_SECONDS (0 for one odds response) are merged into one message,
+    # set ALERT_AGGREGATION=0 to send every alert on its own
+    ALERT_AGGREGATION = os.getenv("ALERT_AGGREGATION", "1") != "0"
+    ALERT_COALESCE_SECONDS = float(os.getenv("ALERT_COALESCE_SECONDS") or 0)
+    # Seconds an event is suspended (not fetched nor checked) after a goal, penalty or red card
+    SUSPENSION_WINDOWS = {
+        "goal": float(os.getenv("GOAL_SUSPENSION_SECONDS") or 0),
+        "penalty": float(os.getenv("PENALTY_SUSPENSION_SECONDS") or 150),
+        "red_card": float(os.getenv("RED_CARD_SUSPENSION_SECONDS") or 150)
+    }
+    # Set VECTORIZED_DETECTION=1 to filter long odds histories as numpy arrays (needs numpy installed)
+    VECTORIZED_DETECTION = os.getenv("VECTORIZED_DETECTION", "0") != "0"
 
     LINE_CHANGE_BOT = os.getenv("LINE_CHANGE_BOT")
     LOGGING_BOT = os.getenv("LOGGING_BOT")
     t_request = HTTPXRequest(connection_pool_size=25)
     line_change_bot = Bot(token=LINE_CHANGE_BOT, request=t_request)
     logging_bot = Bot(token=LOGGING_BOT, request=t_request)
-    LOGS_CHANNEL = os.getenv("LOGS_CHANNEL")
     BLACKLIST_FILE = os.getenv("BLACKLIST_FILE")
 
+    metrics = Metrics() if METRICS_PORT else None
+    markets = MarketRegistry.load(MARKETS_FILE)
+    # When sharded this process only polls the live events, the rest of the budget is split between the workers
+    EVENTS_REQUESTS_PER_HOUR = (min(BETSAPI_REQUESTS_PER_HOUR, int(3600 / max(MIN_CYCLE_SECONDS, 1)))
+                                if DETECTOR_WORKERS else BETSAPI_REQUESTS_PER_HOUR)
+    request_budget = RequestBudget(requests_per_hour=EVENTS_REQUESTS_PER_HOUR)
+    poll_scheduler = PollScheduler(inplay_interval=INPLAY_POLL_SECONDS, prelive_interval=PRELIVE_POLL_SECONDS,
+                                   active_until=markets.active_until())
+    alert_outbox = AlertOutbox(bots={"alerts": line_change_bot, "logs": logging_bot},
+                               max_size=int(os.getenv("ALERT_QUEUE_SIZE") or 1000),
+                               workers=int(os.getenv("ALERT_SENDERS") or 4),
+                               metrics=metrics)
+    detector = LineChangeDetector(events_api_url=BET365_EVENTS_API_URL,
+                                  odds_api_url=BET365_ODDS_API_URL,
+                                  betsapi_token=BET365_API_TOKEN,
+                                  feed_source=(StreamingFeed(ODDS_STREAM_URL, BET365_API_TOKEN)
+                                               if ODDS_STREAM_URL is not None else None),
+                                  max_concurrent_requests=ODDS_FETCH_CONCURRENCY,
+                                  incremental_odds=INCREMENTAL_ODDS,
+                                  alert_outbox=alert_outbox,
+                                  request_budget=request_budget,
+                                  poll_scheduler=poll_scheduler,
+                                  blacklist=Blacklist(BLACKLIST_FILE),
+                                  recorder=ResponseRecorder(RECORD_DIR) if RECORD_DIR else None,
+                                  metrics=metrics,
+                                  markets=markets,
+                                  vectorized_detection=VECTORIZED_DETECTION,
+                                  alert_aggregator=(AlertAggregator(alert_outbox, window=ALERT_COALESCE_SECONDS)
+                                                    if ALERT_AGGREGATION else None),
+                                  suspensions=SuspensionManager(windows=SUSPENSION_WINDOWS))
+
+    sharded_detector = None
+    if DETECTOR_WORKERS:
+        sharded_detector = ShardedDetector(detector, alert_outbox, workers=DETECTOR_WORKERS, worker_config={
+            "detector": {
+                "events_api_url": BET365_EVENTS_API_URL,
+                "odds_api_url": BET365_ODDS_API_URL,
+                "betsapi_token": BET365_API_TOKEN,
+                "max_concurrent_requests": ODDS_FETCH_CONCURRENCY,
+                "incremental_odds": INCREMENTAL_ODDS,
+                "vectorized_detection": VECTORIZED_DETECTION
+            },
+            "requests_per_hour": BETSAPI_REQUESTS_PER_HOUR - EVENTS_REQUESTS_PER_HOUR,
+            "inplay_interval": INPLAY_POLL_SECONDS,
+            "prelive_interval": PRELIVE_POLL_SECONDS,
+            "blacklist_file": BLACKLIST_FILE,
+            "state_db_file": STATE_DB_FILE,
+            "record_dir": RECORD_DIR,
+            "markets_file": MARKETS_FILE,
+            "alert_coalesce_seconds": ALERT_COALESCE_SECONDS if ALERT_AGGREGATION else None,
+            "event_grace_seconds": EVENT_GRACE_SECONDS,
+            "max_tracked_events": MAX_TRACKED_EVENTS,
+            "suspension_windows": SUSPENSION_WINDOWS,
+            "logging": LOG_CONFIG
+        }, metrics=metrics)
+    cycle_detector = sharded_detector if sharded_detector is not None else detector
+    event_lifecycle = EventLifecycle(grace_seconds=EVENT_GRACE_SECONDS, max_events=MAX_TRACKED_EVENTS)
+
+
+    # Detector state is checkpointed after every cycle and reloaded here, set STATE_DB_FILE empty to disable it
+    # When sharded the workers checkpoint their own events and reload them as they are assigned
+    state_store = StateStore(STATE_DB_FILE) if STATE_DB_FILE else None
+    if state_store is not None and sharded_detector is not None:
+        state_store.prune()
+        state_store.close()
+        state_store = None
+    if state_store is not None:
+        restored_states = state_store.load()
+        detector.restore_state(restored_states)
+        # Restored events get the same grace period as events missing from the live events
+        event_lifecycle.observe(restored_states)
+
 
     async def main_loop():
-        while True:
+        # SIGTERM or SIGINT stop the bot after the current cycle, SIGHUP resizes the detector workers
+        shutdown = asyncio.Event()
+        resize_requested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, shutdown.set)
+        if sharded_detector is not None:
+            loop.add_signal_handler(signal.SIGHUP, resize_requested.set)
+
+        async def pause(seconds: float):
+            try:
+                await asyncio.wait_for(shutdown.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        alert_outbox.start()
+        if sharded_detector is not None:
+            sharded_detector.start()
+        else:
+            detector.feed_source.start(detector)
+        if metrics is not None:
+            await metrics.start(METRICS_PORT)
+        cycle_failures = 0
+        while not shutdown.is_set():
             logging.info("New Loop")
+            cycle_started_at = time.monotonic()
             try:
-                current_event_count, current_events = await detector.process()
+                if resize_requested.is_set():
+                    resize_requested.clear()
+                    load_dotenv(override=True)
+                    await sharded_detector.resize(int(os.getenv("DETECTOR_WORKERS") or 0))
+                current_event_count, current_events = await cycle_detector.process()
                 logging.info(f"Events Count: {current_event_count}")
-                logging.info(f"Events List: {current_events}")
-                detector.clean_events(current_events)
-                # The following delay between api calls is added to prevent rate limit of 3600 requests / hour
-                # await asyncio.sleep(current_event_count + 1)
-                # The following delay between api calls is added to prevent rate limit of 1,99,999 requests / hour
-                await asyncio.sleep(current_event_count // 54 + 1)
+                logging.info(f"Alert Outbox: {alert_outbox.stats()}")
+                if isinstance(detector.feed_source, StreamingFeed):
+                    logging.info(f"Odds Stream: {detector.feed_source.stats()}")
+                if sharded_detector is None and detector.alert_aggregator is not None:
+                    logging.info(f"Alert Aggregator: {detector.alert_aggregator.stats()}")
+                if sharded_detector is None:
+                    logging.info(f"Suspensions: {detector.suspensions.stats()}")
+                logging.info(f"Request Budget: {request_budget.stats()}")
+                logging.debug("Circuit Breakers: %s", {breaker.name: breaker.stats() for breaker in
+                                                       detector.http_client.breakers.values()})
+                logging.debug("Events List: %s", current_events)
+                cycle_detector.clean_events(event_lifecycle.observe(current_events))
+                logging.info(f"Event Lifecycle: {event_lifecycle.stats()}")
+                if metrics is not None:
+                    metrics.observe("detector_cycle_seconds", time.monotonic() - cycle_started_at)
+                if state_store is not None:
+                    await state_store.checkpoint(detector.export_changed_state(), detector.event_states)
+                # The hourly rate limit is kept by the request budget, which spreads the api calls over the hour,
+                # this only stops the events api from being polled more often than once per MIN_CYCLE_SECONDS
+                await pause(max(0.0, MIN_CYCLE_SECONDS - (time.monotonic() - cycle_started_at)))
+                cycle_failures = 0
 
             except Exception as e:
-                logging.error(e)
-                pass
+                # A failing cycle (e.g. the events api down) is retried with a growing delay instead of straight away
+                cycle_failures += 1
+                delay = max(MIN_CYCLE_SECONDS, backoff_delay(cycle_failures, MIN_CYCLE_SECONDS, MAX_BACKOFF_SECONDS))
+                logging.error(f"In Main Loop | {type(e).__name__}: {e} | retrying in {delay:.1f}s")
+                await pause(delay)
+
+        logging.info("Shutting down")
+        # The workers drain their alert aggregators and checkpoint their events as they stop
+        if sharded_detector is not None:
+            await sharded_detector.stop()
+        else:
+            await detector.feed_source.stop()
+            if detector.alert_aggregator is not None:
+                detector.alert_aggregator.drain()
+            if state_store is not None:
+                await state_store.checkpoint(detector.export_changed_state(), detector.event_states, write_all=True)
+        await alert_outbox.stop()
+        await detector.http_client.aclose()
+        if state_store is not None:
+            state_store.close()
+        logging.info("Stopped")
 
 
     asyncio.run(main_loop())
@@ -0,0 +1,91 @@
+import logging
+import random
+import time
+from collections import Counter
+from metrics import Metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit breaker of its endpoint is open."""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops the calls to an endpoint after failure_threshold failures in a row, so an outage costs neither quota nor
+    CPU. It stays open for reset_timeout seconds (with jitter), doubling after every failed trial up to
+    max_reset_timeout, then lets one trial call through whose success closes it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 5.0,
+                 max_reset_timeout: float = 300.0, trial_timeout: float = 30.0, metrics: Metrics = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.trial_timeout = trial_timeout  # a trial call which never reported back no longer blocks the next one
+        self.metrics = metrics
+        self.state = CLOSED
+        self.failures = 0  # failures in a row
+        self.trips = 0  # times opened in a row without a success
+        self.opened_until = 0.0
+        self.trial_started_at = 0.0
+        self.transitions = Counter()
+
+    def transition(self, state: str):
+        if state == self.state:
+            return
+        logging.warning(f"Circuit Breaker {self.name} | {self.state} -> {state}")
+        self.transitions[f"{self.state}->{state}"] += 1
+        if self.metrics is not None:
+            self.metrics.increment("circuit_breaker_transitions_total", breaker=self.name, state=state)
+        self.state = state
+
+    def allow(self) -> bool:
+        """Whether a call may be made now, the first call after the open period is the trial call."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if (self.state == OPEN and now >= self.opened_until) or \
+                (self.state == HALF_OPEN and now - self.trial_started_at >= self.trial_timeout):
+            self.transition(HALF_OPEN)
+            self.trial_started_at = now
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        """Seconds until a call may be allowed again."""
+        if self.state == OPEN:
+            return max(0.0, self.opened_until - time.monotonic())
+        if self.state == HALF_OPEN:
+            return min(1.0, self.reset_timeout)
+        return 0.0
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+        self.transition(CLOSED)
+
+    def release(self):
+        """End a trial call which showed neither outcome, the next call is a trial again straight away."""
+        if self.state == HALF_OPEN:
+            self.trial_started_at = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            timeout = min(self.max_reset_timeout, self.reset_timeout * 2 ** self.trips)
+            self.opened_until = time.monotonic() + random.uniform(timeout / 2, timeout)
+            self.trips += 1
+            self.transition(OPEN)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "transitions": dict(self.transitions)}
@@ -0,0 +1,69 @@
+import argparse
+import glob
+import json
+import os
+import time
+from json_codec import ORJSON_AVAILABLE, loads_fast, loads_stdlib
+from odds_points import parse_odds_points
+from recorder import read_recording
+
+
+def odds_payloads(paths: list) -> list:
+    """Bodies of the recorded event odds responses, as the bytes the http client receives."""
+    payloads = []
+    for record in read_recording(paths):
+        if record["status"] == 200 and record["params"].get("event_id") is not None:
+            payloads.append(record["body"].encode("utf-8"))
+    return payloads
+
+
+def time_decoder(payloads: list, loads, rounds: int) -> dict:
+    """Seconds to decode every payload and to parse its odds into data points, best of the rounds."""
+    best_decode = best_total = None
+    for _ in range(rounds):
+        decode_seconds = 0.0
+        started_at = time.perf_counter()
+        for content in payloads:
+            decode_started_at = time.perf_counter()
+            odds = (loads(content).get("results") or {}).get("odds") or {}
+            decode_seconds += time.perf_counter() - decode_started_at
+            for line_type, data in odds.items():
+                parse_odds_points(line_type, data)
+        total_seconds = time.perf_counter() - started_at
+        best_decode = decode_seconds if best_decode is None else min(best_decode, decode_seconds)
+        best_total = total_seconds if best_total is None else min(best_total, total_seconds)
+    return {"decode_seconds": best_decode, "total_seconds": best_total}
+
+
+def benchmark(paths: list, rounds: int = 5) -> dict:
+    payloads = odds_payloads(paths)
+    if not payloads:
+        return {"payloads": 0}
+    megabytes = sum(len(content) for content in payloads) / 1e6
+    report = {"payloads": len(payloads), "megabytes": round(megabytes, 3)}
+    decoders = {"stdlib": loads_stdlib}
+    if ORJSON_AVAILABLE:
+        decoders["orjson"] = loads_fast
+    for name, loads in decoders.items():
+        timings = time_decoder(payloads, loads, rounds)
+        report[name] = {
+            "decode_ms_per_payload": round(timings["decode_seconds"] / len(payloads) * 1000, 4),
+            "decode_mb_per_second": round(megabytes / timings["decode_seconds"], 1),
+            "decode_and_parse_ms_per_payload": round(timings["total_seconds"] / len(payloads) * 1000, 4)
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark decoding recorded BetsAPI odds payloads.")
+    parser.add_argument("recordings", nargs="+", help="recording files or directories written with RECORD_DIR")
+    parser.add_argument("--rounds", type=int, default=5, help="timed passes over the payloads, the best is reported")
+    args = parser.parse_args()
+
+    recording_paths = []
+    for recording in args.recordings:
+        if os.path.isdir(recording):
+            recording_paths.extend(sorted(glob.glob(os.path.join(recording, "*.jsonl.gz"))))
+        else:
+            recording_paths.append(recording)
+    print(json.dumps(benchmark(recording_paths, args.rounds), indent=2))
@@ -0,0 +1,66 @@
+import time
+from collections import Counter
+from typing import Iterable, Set
+
+
+class EventLifecycle:
+    """
+    Last seen times of the live events, deciding which events the detector keeps state for.
+    An event missing from the live events is kept for grace_seconds, so a gap in the events api does not
+    re-baseline it, and beyond max_events tracked events the events missing the longest are dropped first.
+    """
+
+    def __init__(self, grace_seconds: float = 120, max_events: int = 20000):
+        self.grace_seconds = grace_seconds
+        self.max_events = max_events
+        self.last_seen = {}  # event_id -> last seen time, least recently seen first
+        self.missing = 0  # tracked events missing from the last live events
+        self.last_cycle_at = None
+        self.churn = Counter()  # added, returned, expired and capped events since the start
+
+    def observe(self, event_ids: Iterable, now: float = None) -> Set[str]:
+        """Record the current live events and return every event still tracked, the current ones included."""
+        now = time.time() if now is None else now
+        last_seen = self.last_seen
+        current = set(event_ids)
+        for event_id in current:
+            previous = last_seen.pop(event_id, None)
+            if previous is None:
+                self.churn["added"] += 1
+            elif previous != self.last_cycle_at:
+                self.churn["returned"] += 1  # back within the grace period, its state was kept
+            last_seen[event_id] = now
+
+        # Missing events are at the front, the ones missing the longest first
+        horizon = now - self.grace_seconds
+        over_cap = len(last_seen) - self.max_events
+        evicted = []
+        for event_id, seen_at in last_seen.items():
+            if seen_at < horizon:
+                self.churn["expired"] += 1
+            elif len(evicted) < over_cap and event_id not in current:
+                self.churn["capped"] += 1
+            else:
+                break
+            evicted.append(event_id)
+        for event_id in evicted:
+            del last_seen[event_id]
+
+        self.missing = len(last_seen) - len(current)
+        self.last_cycle_at = now
+        return set(last_seen)
+
+    def forget(self, event_ids: Iterable):
+        """Stop tracking events straight away, e.g. events handed over to another worker process."""
+        for event_id in event_ids:
+            self.last_seen.pop(event_id, None)
+
+    def tracked(self) -> Set[str]:
+        return set(self.last_seen)
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self.last_seen),
+            "missing": self.missing,
+            **{kind: self.churn[kind] for kind in ("added", "returned", "expired", "capped")}
+        }
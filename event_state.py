@@ -0,0 +1,66 @@
+from typing import Dict
+
+# Event details kept in the "details" dict of the saved state, in this order
+DETAIL_FIELDS = ("home_team", "away_team", "league", "game_time", "goals", "penalties", "red_cards", "buffer_stop",
+                 "line_moved_at")
+# Last processed match events kept next to the line types in the "last_processed" dict of the saved state
+LAST_PROCESSED_FIELDS = {"goals": "last_goals", "penalties": "last_penalties", "red_cards": "last_red_cards"}
+
+
+class MarketState:
+    """Cursor of one line type of an event, the last processed data point id and its line."""
+    __slots__ = ("last_id", "last_value")
+
+    def __init__(self, last_id: int, last_value: float):
+        self.last_id = last_id
+        self.last_value = last_value
+
+
+class EventState:
+    """
+    Everything the detector keeps about a live event between cycles: its details from the events api, the penalty
+    and red card suspension window, the last goals, penalties and red cards processed and one MarketState per line
+    type. Saved and restored in the {"last_processed": ..., "details": ...} dicts of the state store.
+    """
+    __slots__ = DETAIL_FIELDS + tuple(LAST_PROCESSED_FIELDS.values()) + ("markets",)
+
+    def __init__(self):
+        self.home_team = ''
+        self.away_team = ''
+        self.league = ''
+        self.game_time = None
+        self.goals = None
+        self.penalties = None
+        self.red_cards = None
+        self.buffer_stop = None  # odds are ignored until this time after a penalty or red card
+        self.line_moved_at = None
+        self.last_goals = None
+        self.last_penalties = None
+        self.last_red_cards = None
+        self.markets: Dict[str, MarketState] = {}  # line_type -> MarketState
+
+    def export(self) -> dict:
+        last_processed = {line_type: {"id": market.last_id, "value": market.last_value}
+                          for line_type, market in self.markets.items()}
+        for key, field in LAST_PROCESSED_FIELDS.items():
+            value = getattr(self, field)
+            if value is not None:
+                last_processed[key] = value
+        return {
+            "last_processed": last_processed,
+            "details": {field: getattr(self, field) for field in DETAIL_FIELDS}
+        }
+
+    @classmethod
+    def restore(cls, last_processed: dict, details: dict) -> "EventState":
+        state = cls()
+        for field in DETAIL_FIELDS:
+            if field in details:
+                setattr(state, field, details[field])
+        for key, value in last_processed.items():
+            if key in LAST_PROCESSED_FIELDS:
+                setattr(state, LAST_PROCESSED_FIELDS[key], value)
+            elif isinstance(value, dict) and value.get("id") is not None:
+                state.markets[key] = MarketState(value["id"], value.get("value"))
+        return state
+
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from collections import deque
+from abc import ABC, abstractmethod
+from typing import List
+import httpx
+from circuit_breaker import backoff_delay
+from http_client import raise_for_status
+from json_codec import loads
+
+# Seconds without any data (updates or keep-alive comments) after which a stream is taken as dead
+STREAM_READ_TIMEOUT = 30
+# Data points held per line type of an event which is not eligible, the oldest are dropped beyond it
+MAX_HELD_POINTS = 200
+
+
+class FeedSource(ABC):
+    """
+    Where LineChangeDetector gets the odds of the eligible events from.
+    process() hands every cycle's eligible events (live, not blacklisted, not right after a goal, penalty or red
+    card) to cycle(), start() and stop() run around the detector's life.
+    """
+
+    def start(self, detector):
+        pass
+
+    @abstractmethod
+    async def cycle(self, detector, odds_events: List[dict]):
+        """Run detection for the odds of the eligible events, or take note of them."""
+
+    async def stop(self):
+        pass
+
+
+class PollingFeed(FeedSource):
+    """The REST poller, every cycle fetches the full odds of the events the poll scheduler has due."""
+
+    async def cycle(self, detector, odds_events: List[dict]):
+        # Only the events whose odds are due are fetched this cycle, an event whose fetch fails is due again next cycle
+        eligible_events = {odds_event["id"]: odds_event for odds_event in odds_events}
+        odds_events = [eligible_events[event_id] for event_id in detector.poll_scheduler.pop_due(eligible_events)]
+
+        # Fetch odds for all due events at once, detection for each event runs as soon as its response arrives
+        # Hot events are started first so they are also first in line for the request budget
+        odds_events.sort(key=lambda odds_event: detector.odds_priority(odds_event["id"]))
+        await asyncio.gather(*(detector.process_event_odds(event) for event in odds_events))
+
+
+class StreamingFeed(FeedSource):
+    """
+    Odds updates pushed as server-sent events, detection runs for every update as it arrives instead of once per
+    cycle. Each update is an "odds" event whose data is {"event_id": ..., "odds": {line_type: [data points]}}
+    with the data points latest first, as in the odds api. The live events still come from the events api cycle,
+    updates of events which are not eligible yet are held until they are, or while they are suspended. Updates of
+    events which are not eligible for any other reason (untracked, blacklisted) are dropped at the next cycle.
+    Needs the incremental odds buffers, which also drop the data points resent after a reconnect.
+    """
+
+    def __init__(self, stream_url: str, betsapi_token: str, reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0):
+        self.stream_url = stream_url
+        self.betsapi_token = betsapi_token
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.detector = None
+        self.task = None
+        self.eligible = {}  # event_id -> event, as of the last cycle
+        # event_id -> line_type -> data points of updates waiting for the event to be eligible, oldest first
+        self.held = {}
+        self.updates = 0
+        self.reconnects = 0
+
+    def start(self, detector):
+        self.detector = detector
+        self.task = asyncio.create_task(self.run())
+
+    async def cycle(self, detector, odds_events: List[dict]):
+        self.eligible = {odds_event["id"]: odds_event for odds_event in odds_events}
+        # Updates held while their event was not eligible, only suspended events keep holding theirs
+        for event_id in list(self.held):
+            if event_id in self.eligible:
+                held = self.held.pop(event_id)
+                odds = {line_type: list(reversed(points)) for line_type, points in held.items()}
+                await detector.apply_event_odds(self.eligible[event_id], odds)
+            elif not detector.suspensions.is_suspended(event_id):
+                del self.held[event_id]
+
+    async def apply(self, update: dict):
+        event_id = str(update.get("event_id"))
+        odds = update.get("odds") or {}
+        self.updates += 1
+        event = self.eligible.get(event_id)
+        if event is None:
+            held = self.held.setdefault(event_id, {})
+            for line_type, points in odds.items():
+                if line_type not in held:
+                    held[line_type] = deque(maxlen=MAX_HELD_POINTS)
+                held[line_type].extend(reversed(points))
+            return
+        await self.detector.apply_event_odds(event, odds)
+
+    async def run(self):
+        attempt = 0
+        while True:
+            try:
+                if self.detector.http_client.request_budget is not None:
+                    await self.detector.http_client.request_budget.acquire()
+                async with self.detector.http_client.client.stream(
+                        "GET", self.stream_url, params={"token": self.betsapi_token},
+                        timeout=httpx.Timeout(10.0, read=STREAM_READ_TIMEOUT)) as response:
+                    raise_for_status(response)
+                    logging.info(f"Odds Stream connected | {self.stream_url}")
+                    attempt = 0
+                    event_name, data_lines = "message", []
+                    async for line in response.aiter_lines():
+                        if line.startswith(":"):
+                            continue  # keep-alive comment
+                        if line:
+                            field, _, value = line.partition(":")
+                            value = value[1:] if value.startswith(" ") else value
+                            if field == "event":
+                                event_name = value
+                            elif field == "data":
+                                data_lines.append(value)
+                            continue
+                        # A blank line ends the event
+                        if event_name == "odds" and data_lines:
+                            try:
+                                await self.apply(loads("\n".join(data_lines)))
+                            except Exception as e:
+                                logging.error(f"In Odds Stream Update | {e}")
+                        event_name, data_lines = "message", []
+                logging.warning(f"Odds Stream closed | {self.stream_url}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"In Odds Stream | {self.stream_url} | {type(e).__name__}: {e}")
+            self.reconnects += 1
+            delay = backoff_delay(attempt, self.reconnect_delay, self.max_reconnect_delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {"updates": self.updates, "held_events": len(self.held), "reconnects": self.reconnects}
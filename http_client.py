@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import random
+import time
+import httpx
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from json_codec import loads
+from metrics import Metrics
+from rate_limiter import RequestBudget
+from recorder import ResponseRecorder
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2]), plain HTTP/1.1 keep-alive is used without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Status codes which are worth another attempt, everything else is raised straight away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class BetsApiError(Exception):
+    """
+    Raised for an unsuccessful BetsAPI answer instead of httpx.HTTPStatusError, whose message holds the full request
+    URL and so the api token in its query. Only the status and the endpoint path are kept.
+    """
+
+    def __init__(self, status_code: int, endpoint: str):
+        super().__init__(f"{status_code} {httpx.codes.get_reason_phrase(status_code)} | {endpoint}")
+        self.status_code = status_code
+        self.endpoint = endpoint
+
+
+def raise_for_status(response: httpx.Response):
+    if not response.is_success:
+        raise BetsApiError(response.status_code, response.url.path)
+
+
+class BetsApiClient:
+    """Shared async HTTP client with a persistent connection pool and bounded retries."""
+
+    def __init__(self, max_connections: int = 50, max_keepalive_connections: int = 20, timeout: float = 10.0,
+                 connect_timeout: float = 5.0, retries: int = 2, backoff: float = 0.5, max_backoff: float = 5.0,
+                 request_budget: RequestBudget = None, recorder: ResponseRecorder = None,
+                 metrics: Metrics = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Every attempt, retries included, is paid for from the shared hourly request budget
+        self.request_budget = request_budget
+        # Optionally keeps every successful response for offline replays and benchmarks
+        self.recorder = recorder
+        # Optional latency, status and size histograms of every attempt
+        self.metrics = metrics
+        # One circuit breaker per endpoint path, an endpoint which keeps failing is not called until it recovers
+        self.breakers = {}
+        # cache key -> (etag, last_modified, content, data) of the last response of get_json_cached
+        self.response_cache = {}
+        # Responses are compressed when the API supports it, httpx asks for gzip/deflate and decodes them itself
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections,
+                                keepalive_expiry=60),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+
+    def retry_delay(self, attempt: int, response: httpx.Response = None) -> float:
+        """Exponential backoff with full jitter, a Retry-After header from the API takes precedence."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        endpoint = httpx.URL(url).path
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(f"betsapi {endpoint}", metrics=self.metrics)
+        return breaker
+
+    async def get(self, url: str, params: dict = None, timeout: float = None, priority: int = 0,
+                  headers: dict = None) -> httpx.Response:
+        request_timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        breaker = self.breaker(url)
+        attempt = 0
+        while True:
+            # Checked before the request budget, calls to an endpoint which is down cost no quota
+            if not breaker.allow():
+                raise CircuitOpenError(f"{breaker.name} is open, retry in {breaker.retry_in():.1f}s")
+            if self.request_budget is not None:
+                await self.request_budget.acquire(priority)
+            started_at = time.perf_counter()
+            try:
+                response = await self.client.get(url, params=params, headers=headers, timeout=request_timeout)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                if self.metrics is not None:
+                    self.metrics.observe("betsapi_request_seconds", time.perf_counter() - started_at,
+                                         endpoint=httpx.URL(url).path, status="error")
+                if attempt >= self.retries:
+                    raise
+                delay = self.retry_delay(attempt)
+                logging.warning(f"Request Failed, retrying in {delay:.2f}s | {url} | {type(e).__name__}: {e}")
+            else:
+                if self.metrics is not None:
+                    endpoint = response.url.path
+                    self.metrics.observe("betsapi_request_seconds", time.perf_counter() - started_at,
+                                         endpoint=endpoint, status=str(response.status_code))
+                    self.metrics.observe("betsapi_response_bytes", len(response.content), endpoint=endpoint)
+                # Rate limits and server errors count against the endpoint, any other answer shows it is up
+                if response.status_code in RETRY_STATUS_CODES:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status_code == 304 and headers:
+                    # Not Modified answer to a conditional request, the caller still has the body
+                    return response
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    raise_for_status(response)
+                    if self.recorder is not None:
+                        self.recorder.record(url, params, response.status_code, response.content)
+                    return response
+                delay = self.retry_delay(attempt, response)
+                logging.warning(f"Request Failed, retrying in {delay:.2f}s | {url} | {response.status_code}")
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, params: dict = None, timeout: float = None, priority: int = 0):
+        response = await self.get(url, params=params, timeout=timeout, priority=priority)
+        return loads(response.content)
+
+    async def get_json_cached(self, url: str, params: dict = None, timeout: float = None, priority: int = 0,
+                              cache_key: str = None):
+        """
+        get_json for a resource polled with the same parameters every cycle, returns the data and whether it changed.
+        The validators of the last response are sent back so the API can answer 304 Not Modified, and a body equal
+        to the last one is not decoded again, in both cases the data decoded last time is returned.
+        """
+        cache_key = cache_key or url
+        cached = self.response_cache.get(cache_key)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, content, data = cached
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
+
+        response = await self.get(url, params=params, timeout=timeout, priority=priority, headers=headers)
+        if cached is not None and (response.status_code == 304 or response.content == content):
+            if response.status_code == 304 and self.recorder is not None:
+                self.recorder.record(url, params, 200, content)
+            return data, False
+
+        data = loads(response.content)
+        self.response_cache[cache_key] = (response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                          response.content, data)
+        return data, True
+
+    async def aclose(self):
+        await self.client.aclose()
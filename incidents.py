@@ -0,0 +1,148 @@
+import math
+import time
+from collections import Counter, deque
+from typing import Dict, List, Tuple
+
+# Incident kinds with the EventState field of the inplay feed they come from and the field of their last value
+INCIDENT_FIELDS = (("goal", "goals", "last_goals"),
+                   ("penalty", "penalties", "last_penalties"),
+                   ("red_card", "red_cards", "last_red_cards"))
+# Seconds an event is suspended after an incident, the odds of the event are neither fetched nor checked meanwhile
+DEFAULT_SUSPENSION_SECONDS = {"goal": 0, "penalty": 150, "red_card": 150}
+
+
+class Incident:
+    """A goal, penalty or red card seen in the inplay feed, and until when it suspends its event."""
+    __slots__ = ("event_id", "kind", "previous", "current", "at", "until")
+
+    def __init__(self, event_id: str, kind: str, previous, current, at: float, until: float = None):
+        self.event_id = event_id
+        self.kind = kind
+        self.previous = previous
+        self.current = current
+        self.at = at
+        self.until = until  # None when this kind of incident does not suspend the event
+
+    def __repr__(self):
+        return f"Incident({self.event_id}, {self.kind}, {self.previous} -> {self.current})"
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel of deadlines, advance() only visits the slots of the ticks passed since the last call
+    instead of every scheduled key. Deadlines further out than one turn of the wheel wait in their slot for
+    the turns in between.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]  # key -> deadline
+        self.deadlines = {}  # key -> (deadline, slot) of every scheduled key
+        self.current_tick = None  # last tick advanced to
+
+    def schedule(self, key, deadline: float):
+        self.cancel(key)
+        tick = math.floor(deadline / self.tick)
+        if self.current_tick is not None:
+            tick = max(tick, self.current_tick)  # already due, expires on the next advance
+        slot = self.slots[tick % len(self.slots)]
+        slot[key] = deadline
+        self.deadlines[key] = (deadline, slot)
+
+    def cancel(self, key):
+        scheduled = self.deadlines.pop(key, None)
+        if scheduled is not None:
+            del scheduled[1][key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.deadlines
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def advance(self, now: float) -> List:
+        """Remove and return the keys whose deadline is at or before now."""
+        now_tick = math.floor(now / self.tick)
+        if self.current_tick is None:
+            self.current_tick = now_tick - len(self.slots) + 1
+        # The current tick is visited again for its deadlines later in the tick, a gap longer than one turn visits
+        # every slot once
+        first_tick = max(self.current_tick, now_tick - len(self.slots) + 1)
+        expired = []
+        for tick in range(first_tick, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            for key, deadline in list(slot.items()):
+                if deadline <= now:
+                    del slot[key]
+                    del self.deadlines[key]
+                    expired.append(key)
+        self.current_tick = max(self.current_tick, now_tick)
+        return expired
+
+
+class SuspensionManager:
+    """
+    Turns the goal, penalty and red card changes of the inplay feed into incidents and keeps the events suspended
+    after them on a timer wheel, for the number of seconds set per kind of incident in windows.
+    Suspended events are left out of the odds fetches until their window is over.
+    """
+
+    def __init__(self, windows: Dict[str, float] = None, tick: float = 1.0, history: int = 1000):
+        self.windows = dict(DEFAULT_SUSPENSION_SECONDS, **(windows or {}))
+        self.wheel = TimerWheel(tick=tick)
+        self.incidents = deque(maxlen=history)  # the most recent incidents
+        self.counts = Counter()  # incidents per kind, suspensions and resumes since the start
+
+    def detect(self, event_id: str, state, now: float = None) -> Tuple[bool, List[Incident]]:
+        """
+        Compare the goals, penalties and red cards of an event with the last ones processed and move them on.
+        Returns whether any of them changed, the first values of an event included, and the incidents, the changes
+        from one known value to another. Incidents with a window suspend the event and set its buffer_stop, the
+        time before which its odds data points are ignored.
+        """
+        now = time.time() if now is None else now
+        changed = False
+        incidents = []
+        for kind, field, last_field in INCIDENT_FIELDS:
+            previous = getattr(state, last_field)
+            current = getattr(state, field)
+            if previous == current:
+                continue
+            changed = True
+            setattr(state, last_field, current)
+            if previous is None or current is None:
+                continue
+            window = self.windows.get(kind, 0)
+            incident = Incident(event_id, kind, previous, current, now, now + window if window > 0 else None)
+            incidents.append(incident)
+            self.incidents.append(incident)
+            self.counts[kind] += 1
+            if incident.until is not None:
+                state.buffer_stop = max(state.buffer_stop or 0, incident.until)
+                self.suspend(event_id, state.buffer_stop)
+        return changed, incidents
+
+    def suspend(self, event_id: str, until: float):
+        if event_id not in self.wheel:
+            self.counts["suspended"] += 1
+        self.wheel.schedule(event_id, until)
+
+    def is_suspended(self, event_id: str) -> bool:
+        return event_id in self.wheel
+
+    def advance(self, now: float = None) -> List[str]:
+        """Lift the suspensions which are over and return their events."""
+        resumed = self.wheel.advance(time.time() if now is None else now)
+        self.counts["resumed"] += len(resumed)
+        return resumed
+
+    def forget(self, event_id: str):
+        self.wheel.cancel(event_id)
+
+    def suspended(self) -> List[str]:
+        return list(self.wheel.deadlines)
+
+    def stats(self) -> dict:
+        return {"suspended_now": len(self.wheel), **self.counts}
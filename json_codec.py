@@ -0,0 +1,22 @@
+import json
+
+# BetsAPI responses are decoded with the optional orjson package when it is installed (pip install orjson),
+# it parses the odds payloads several times faster than the json module it falls back to
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+
+def loads_stdlib(content: bytes):
+    return json.loads(content)
+
+
+def loads_fast(content: bytes):
+    return orjson.loads(content)
+
+
+# Both raise a ValueError (json.JSONDecodeError) on an invalid body
+loads = loads_fast if ORJSON_AVAILABLE else loads_stdlib
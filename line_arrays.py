@@ -0,0 +1,111 @@
+from typing import List
+from line_window import MIN_ALERT_CHANGE
+from odds_buffer import OddsHistoryBuffer
+from odds_points import OddsPoint
+
+# The vectorized detection path needs the optional numpy package (pip install numpy)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Shorter histories are faster on the plain Python path than converting them to arrays
+VECTORIZE_MIN_POINTS = 1000
+
+
+class LineColumns:
+    """
+    Columnar arrays of an odds history in the api order (latest first), copied from the columns the odds buffer
+    keeps or otherwise built in one pass over the points.
+    Gives the same valid and cleaned data points as the loops in detect_changes.
+    """
+
+    def __init__(self, points: List[OddsPoint], odds_buffer: OddsHistoryBuffer = None):
+        count = len(points)
+        self.points = points
+        if odds_buffer is not None and odds_buffer.keep_columns and len(odds_buffer.add_times) == count:
+            # Copied out of the buffer's columns (reversed to the api order) rather than read from every point
+            self.add_time = np.frombuffer(odds_buffer.add_times, dtype=np.int64)[::-1].copy()
+            self.handicap = np.frombuffer(odds_buffer.handicaps, dtype=np.float64)[::-1].copy()
+            self.odds_open = np.frombuffer(odds_buffer.odds_open, dtype=np.int8)[::-1] != 0
+        else:
+            self.add_time = np.fromiter((point.add_time for point in points), dtype=np.int64, count=count)
+            self.handicap = np.fromiter((point.handicap for point in points), dtype=np.float64, count=count)
+            self.odds_open = np.fromiter((point.odds_open for point in points), dtype=np.bool_, count=count)
+        self.valid_indexes = None
+
+    def valid_points(self) -> List[OddsPoint]:
+        """Points whose previous point has the same line with both odds open, latest first."""
+        count = len(self.points)
+        if count < 3:
+            self.valid_indexes = np.empty(0, dtype=np.intp)
+        else:
+            handicap, odds_open = self.handicap, self.odds_open
+            valid = (handicap[1:count - 1] == handicap[:count - 2]) & odds_open[1:count - 1] & odds_open[:count - 2]
+            self.valid_indexes = np.flatnonzero(valid)
+        return [self.points[index] for index in self.valid_indexes.tolist()]
+
+    def cleaned_points(self) -> List[OddsPoint]:
+        """The latest point of every run of valid points on the same line, oldest first."""
+        if self.valid_indexes is None:
+            self.valid_points()
+        if not len(self.valid_indexes):
+            return []
+        oldest_first = self.valid_indexes[::-1]
+        handicap = self.handicap[oldest_first]
+        run_ends = np.empty(len(oldest_first), dtype=np.bool_)
+        run_ends[:-1] = handicap[1:] != handicap[:-1]
+        run_ends[-1] = True
+        return [self.points[index] for index in oldest_first[run_ends].tolist()]
+
+
+class ColumnLineWindow:
+    """
+    Same answers as SlidingLineWindow for a known set of reference times, with the window bounds and the
+    highest and lowest line of every window found at once by binary search and reduceat.
+    """
+
+    def __init__(self, points: List[OddsPoint], window: int, reference_times: list,
+                 add_time: "np.ndarray", handicap: "np.ndarray"):
+        self.points = points  # oldest data point first
+        references = np.asarray(reference_times, dtype=np.int64)
+        ends = np.searchsorted(add_time, references, side="left")
+        starts = np.minimum(np.searchsorted(add_time, references - window, side="left"), ends)
+
+        # reduceat over (start, end) pairs, the extra element keeps an end at the last point a valid index
+        bounds = np.column_stack((starts, ends)).ravel()
+        padded = np.append(handicap, 0.0)
+        highs = np.maximum.reduceat(padded, bounds)[::2]
+        lows = np.minimum.reduceat(padded, bounds)[::2]
+        self.windows = {
+            reference_time: (start, end, high, low)
+            for reference_time, start, end, high, low in zip(references.tolist(), starts.tolist(), ends.tolist(),
+                                                               highs.tolist(), lows.tolist())
+        }
+        self.current = (0, 0, 0.0, 0.0)
+
+    @classmethod
+    def build(cls, points: List[OddsPoint], window: int, reference_times: list):
+        """The window over points, None when their times are out of order and need the sliding window."""
+        add_time = np.fromiter((point.add_time for point in points), dtype=np.int64, count=len(points))
+        if len(points) > 1 and not bool(np.all(add_time[1:] >= add_time[:-1])):
+            return None
+        handicap = np.fromiter((point.handicap for point in points), dtype=np.float64, count=len(points))
+        return cls(points, window, reference_times, add_time, handicap)
+
+    def advance(self, reference_time: int):
+        self.current = self.windows[reference_time]
+
+    def max_change(self, value: float) -> float:
+        start, end, high, low = self.current
+        if start >= end:
+            return 0.0
+        return max(high - value, value - low)
+
+    def candidates(self, value: float, min_change: float = MIN_ALERT_CHANGE):
+        if self.max_change(value) < min_change:
+            return iter(())
+        start, end = self.current[0], self.current[1]
+        return (self.points[i] for i in range(end - 1, start - 1, -1))
@@ -0,0 +1,79 @@
+from collections import deque
+from typing import Iterator, List
+from odds_points import OddsPoint
+
+# Only line moves within this many seconds are considered as a single change
+DETECTION_WINDOW = 150
+
+# Handicap change thresholds for each alert level, checked from the strongest down
+CHANGE_THRESHOLDS = (
+    ("HARD", 1.0),
+    ("MEDIUM", 0.75),
+    ("SOFT", 0.5)
+)
+MIN_ALERT_CHANGE = CHANGE_THRESHOLDS[-1][1]
+
+
+def classify_change(handicap_change: float, thresholds: tuple = CHANGE_THRESHOLDS):
+    """Alert level for an absolute handicap change, None when it is below every threshold."""
+    for change_type_flag, threshold in thresholds:
+        if handicap_change >= threshold:
+            return change_type_flag
+    return None
+
+
+class SlidingLineWindow:
+    """
+    Points within the DETECTION_WINDOW seconds before a reference time which only moves forward.
+    Monotonic deques keep the highest and lowest line of the window so the largest move from a value
+    is known in O(1), and the window is only walked when that move is big enough for an alert.
+    """
+
+    def __init__(self, points: List[OddsPoint], window: int = DETECTION_WINDOW):
+        self.points = points  # oldest data point first
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.start = 0
+        self.end = 0
+        self.reference_time = None
+        self.max_indexes = deque()
+        self.min_indexes = deque()
+
+    def advance(self, reference_time: int):
+        """Slide the window to hold the points older than reference_time by at most `window` seconds."""
+        if self.reference_time is not None and reference_time < self.reference_time:
+            self.reset()
+        self.reference_time = reference_time
+
+        points = self.points
+        while self.end < len(points) and points[self.end].add_time < reference_time:
+            handicap = points[self.end].handicap
+            while self.max_indexes and points[self.max_indexes[-1]].handicap <= handicap:
+                self.max_indexes.pop()
+            self.max_indexes.append(self.end)
+            while self.min_indexes and points[self.min_indexes[-1]].handicap >= handicap:
+                self.min_indexes.pop()
+            self.min_indexes.append(self.end)
+            self.end += 1
+
+        while self.start < self.end and reference_time - points[self.start].add_time > self.window:
+            self.start += 1
+        while self.max_indexes and self.max_indexes[0] < self.start:
+            self.max_indexes.popleft()
+        while self.min_indexes and self.min_indexes[0] < self.start:
+            self.min_indexes.popleft()
+
+    def max_change(self, value: float) -> float:
+        """Largest absolute handicap change from value to any point in the window."""
+        if not self.max_indexes:
+            return 0.0
+        return max(self.points[self.max_indexes[0]].handicap - value,
+                   value - self.points[self.min_indexes[0]].handicap)
+
+    def candidates(self, value: float, min_change: float = MIN_ALERT_CHANGE) -> Iterator[OddsPoint]:
+        """Window points from latest to oldest, nothing when no point has moved by min_change."""
+        if self.max_change(value) < min_change:
+            return iter(())
+        return (self.points[i] for i in range(self.end - 1, self.start - 1, -1))
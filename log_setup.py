@@ -0,0 +1,39 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# httpx logs every request at INFO with its full URL, which holds the BetsAPI token or the Telegram bot token
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+
+def setup_logging(log_file: str, level: str = "INFO", max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5,
+                  rotate_when: str = None) -> QueueListener:
+    """
+    Route all logging through an in-memory queue to a background thread which writes the log file,
+    so a log call on the event loop never waits on the disk.
+    The file is rotated at max_bytes, or on the rotate_when schedule (e.g. "midnight") when that is given.
+    """
+    if rotate_when:
+        file_handler = TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count,
+                                                encoding="utf-8")
+    else:
+        file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(level.upper())
+    for logger_name in QUIET_LOGGERS:
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,80 @@
+import json
+import os
+from typing import List
+from line_window import CHANGE_THRESHOLDS, DETECTION_WINDOW
+
+# Sport of events which do not say which sport they are
+DEFAULT_SPORT_ID = 1
+
+# The markets alerted on unless MARKETS_FILE points to a JSON list of markets in the same format
+DEFAULT_MARKETS = [
+    {"sport_id": 1, "market_id": 2, "name": "Asian Handicap", "odds_fields": ["home_od", "away_od"]},
+    {"sport_id": 1, "market_id": 3, "name": "Goal Line", "odds_fields": ["over_od", "under_od"]},
+    {"sport_id": 1, "market_id": 5, "name": "1st Half Asian Handicap", "odds_fields": ["home_od", "away_od"],
+     "active_until": 45},
+    {"sport_id": 1, "market_id": 6, "name": "1st Half Goal Line", "odds_fields": ["over_od", "under_od"],
+     "active_until": 45}
+]
+
+
+class Market:
+    """
+    Detection settings of one market of one sport, keyed like the odds api data ("<sport_id>_<market_id>").
+    channels maps alert levels to the env variables holding their chat ids, levels not in it use the
+    SOFT/MEDIUM/HARD_ALERTS_CHANNEL defaults.
+    """
+
+    def __init__(self, sport_id: int, market_id: int, name: str, odds_fields: list,
+                 thresholds: list = CHANGE_THRESHOLDS, window: int = DETECTION_WINDOW, channels: dict = None,
+                 active_until: int = None, enabled: bool = True):
+        self.sport_id = int(sport_id)
+        self.market_id = int(market_id)
+        self.key = f"{self.sport_id}_{self.market_id}"
+        self.name = name
+        self.odds_fields = tuple(odds_fields)  # odds which have to be open for a data point to be valid
+        # Strongest alert level first, as classify_change expects
+        self.thresholds = tuple(sorted(((flag, float(threshold)) for flag, threshold in thresholds),
+                                       key=lambda level: level[1], reverse=True))
+        self.min_change = self.thresholds[-1][1]
+        # Rank of every alert level, the strongest highest
+        self.severity = {flag: len(self.thresholds) - index for index, (flag, _) in enumerate(self.thresholds)}
+        self.window = window
+        self.channels = {flag: os.getenv(env_name) for flag, env_name in (channels or {}).items()}
+        self.active_until = active_until  # game minute after which the line no longer moves, e.g. 45 for 1st half
+        self.enabled = enabled
+
+
+class MarketRegistry:
+    """The enabled markets by key and by sport, only these are fetched and alerted on."""
+
+    def __init__(self, markets: List[Market]):
+        self.markets = {market.key: market for market in markets if market.enabled}
+        self.sport_markets = {}
+        for market in self.markets.values():
+            self.sport_markets.setdefault(market.sport_id, []).append(market)
+
+    @classmethod
+    def load(cls, path: str = None):
+        """Markets from a JSON file, the built-in soccer markets when no file is given."""
+        if path:
+            with open(path, "r") as file:
+                definitions = json.load(file)
+        else:
+            definitions = DEFAULT_MARKETS
+        return cls([Market(**definition) for definition in definitions])
+
+    def get(self, key: str) -> Market:
+        return self.markets.get(key)
+
+    def sports(self) -> List[int]:
+        return sorted(self.sport_markets)
+
+    def for_sport(self, sport_id) -> List[Market]:
+        return self.sport_markets.get(int(sport_id or DEFAULT_SPORT_ID), [])
+
+    def odds_market(self, sport_id) -> str:
+        """odds_market parameter of the odds api for the enabled markets of a sport."""
+        return ",".join(str(market.market_id) for market in self.for_sport(sport_id))
+
+    def active_until(self) -> dict:
+        return {key: market.active_until for key, market in self.markets.items() if market.active_until is not None}
@@ -0,0 +1,135 @@
+import asyncio
+import bisect
+import logging
+
+# Upper bounds of the histogram buckets, in seconds for timings and in bytes for response sizes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+METRICS = {
+    "detector_cycle_seconds": ("Duration of a full detector poll cycle", LATENCY_BUCKETS),
+    "betsapi_request_seconds": ("Latency of a BetsAPI request attempt", LATENCY_BUCKETS),
+    "betsapi_response_bytes": ("Body size of a BetsAPI response", SIZE_BUCKETS),
+    "detect_changes_seconds": ("Duration of detect_changes for one event and line type", LATENCY_BUCKETS),
+    "alert_queue_wait_seconds": ("Time a Telegram message waited in the alert outbox", LATENCY_BUCKETS),
+    "telegram_send_seconds": ("Latency of a Telegram sendMessage call", LATENCY_BUCKETS)
+}
+
+COUNTERS = {
+    "circuit_breaker_transitions_total": "State changes of the BetsAPI and Telegram circuit breakers"
+}
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last count is for values above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    In-process histograms of the hot path timings and a few counters, served in the Prometheus text format on /metrics.
+    Components take an optional Metrics and skip their instrumentation when it is None.
+    """
+
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> count
+        self.server = None
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(METRICS[name][1])
+        histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def collect(self) -> tuple:
+        """Take the histograms and counters observed since the last call, to merge them into another process' Metrics."""
+        histograms = {key: (histogram.counts, histogram.sum, histogram.count)
+                      for key, histogram in self.histograms.items()}
+        counters = self.counters
+        self.histograms, self.counters = {}, {}
+        return histograms, counters
+
+    def merge(self, collected: tuple):
+        histograms, counters = collected
+        for key, (counts, total, count) in histograms.items():
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(METRICS[key[0]][1])
+            for index, bucket_count in enumerate(counts):
+                histogram.counts[index] += bucket_count
+            histogram.sum += total
+            histogram.count += count
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        for name, (help_text, _) in METRICS.items():
+            series = sorted((labels, histogram) for (metric_name, labels), histogram in self.histograms.items()
+                            if metric_name == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                separator = "," if label_text else ""
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label_text}{separator}le="{bucket}"}} {cumulative}')
+                label_block = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}_sum{label_block} {histogram.sum}")
+                lines.append(f"{name}_count{label_block} {histogram.count}")
+        for name, help_text in COUNTERS.items():
+            series = sorted((labels, count) for (counter_name, labels), count in self.counters.items()
+                            if counter_name == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, count in series:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                label_block = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}{label_block} {count}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # the request headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logging.error(f"In Metrics Endpoint | {e}")
+        finally:
+            writer.close()
+
+    async def start(self, port: int, host: str = "127.0.0.1"):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        logging.info(f"Metrics served on http://{host}:{port}/metrics")
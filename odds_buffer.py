@@ -0,0 +1,75 @@
+from array import array
+from collections import deque
+from typing import List
+from line_window import DETECTION_WINDOW
+from odds_points import OddsPoint, parse_odds_points
+
+
+class OddsHistoryBuffer:
+    """
+    Ring buffer of the odds data points of one event line type, oldest first.
+    Only holds what detect_changes can still use: the DETECTION_WINDOW seconds before the oldest unprocessed
+    data point, plus the two older data points the valid point check looks back at.
+    """
+
+    def __init__(self, line_type: str, window: int = DETECTION_WINDOW, odds_fields: tuple = None,
+                 keep_columns: bool = False):
+        self.line_type = line_type
+        self.window = window
+        self.odds_fields = odds_fields
+        self.points = deque()
+        # Typed columns of the buffered points for the numpy path of detect_changes, filled as points are parsed
+        self.keep_columns = keep_columns
+        self.add_times = array("q")
+        self.handicaps = array("d")
+        self.odds_open = array("b")
+
+    @property
+    def latest_time(self):
+        return self.points[-1].add_time if self.points else None
+
+    def extend(self, data: list) -> int:
+        """Parse and append only the data points newer than the latest buffered one, data is latest first."""
+        latest_id = self.points[-1].id if self.points else None
+        new_data = []
+        for raw in data:
+            if latest_id is not None and raw["id"] <= latest_id:
+                break
+            new_data.append(raw)
+        new_data.reverse()
+
+        new_points = parse_odds_points(self.line_type, new_data, self.odds_fields)
+        self.points.extend(new_points)
+        if self.keep_columns:
+            for point in new_points:
+                self.add_times.append(point.add_time)
+                self.handicaps.append(point.handicap)
+                self.odds_open.append(point.odds_open)
+        return len(new_points)
+
+    def latest_first(self) -> List[OddsPoint]:
+        """Buffered data points in the odds api order, as detect_changes expects them."""
+        return list(reversed(self.points))
+
+    def trim(self, last_processed_id):
+        """Drop the data points which can no longer be the start of a move for any unprocessed data point."""
+        points = self.points
+        if not points:
+            return
+
+        horizon_time = points[-1].add_time
+        if last_processed_id is not None:
+            for point in points:
+                if point.id > last_processed_id:
+                    horizon_time = point.add_time
+                    break
+        horizon_time -= self.window
+
+        dropped = 0
+        while len(points) > 2 and points[2].add_time < horizon_time:
+            points.popleft()
+            dropped += 1
+        if self.keep_columns and dropped:
+            del self.add_times[:dropped]
+            del self.handicaps[:dropped]
+            del self.odds_open[:dropped]
@@ -0,0 +1,54 @@
+import logging
+import statistics
+from typing import List
+
+# Odds fields which have to be present (not '-') for a data point of each line type to be usable
+ODDS_FIELDS = {
+    "1_2": ("home_od", "away_od"),
+    "1_3": ("over_od", "under_od"),
+    "1_5": ("home_od", "away_od"),
+    "1_6": ("over_od", "under_od")
+}
+
+
+def parse_handicap(handicap: str) -> float:
+    """Numeric line of a handicap string, "1.0,1.5" is a split line whose actual value is 1.25"""
+    # Most lines are single or split in two, both are exact without going through fmean
+    if ',' not in handicap:
+        return float(handicap)
+    values = handicap.split(',')
+    if len(values) == 2:
+        return (float(values[0]) + float(values[1])) / 2
+    return statistics.fmean(map(float, values))
+
+
+class OddsPoint:
+    """A single odds data point parsed once from the odds api, the raw dict is kept for logging."""
+    __slots__ = ("id", "add_time", "handicap", "odds_open", "ss", "goals", "raw")
+
+    def __init__(self, line_type: str, raw: dict, odds_fields: tuple = None):
+        self.id = raw["id"]
+        self.add_time = int(raw["add_time"])
+        self.handicap = parse_handicap(raw["handicap"])
+        if odds_fields is None:
+            odds_fields = ODDS_FIELDS.get(line_type, ())
+        self.odds_open = all(raw.get(field, '-') != '-' for field in odds_fields)
+        self.ss = raw.get("ss")
+        # Goals stay a list like ["1", "0"] so they compare directly with the inplay api stats
+        score = raw.get("ss", '-')
+        self.goals = score.split('-') if score is not None else None
+        self.raw = raw
+
+    def __repr__(self):
+        return repr(self.raw)
+
+
+def parse_odds_points(line_type: str, data: list, odds_fields: tuple = None) -> List[OddsPoint]:
+    """Parse the odds api data of one line type, keeping the api order (latest data point first)."""
+    points = []
+    for raw in data:
+        try:
+            points.append(OddsPoint(line_type, raw, odds_fields))
+        except Exception as e:
+            logging.error(f"In Parsing Odds Point | {line_type} | {raw} | {e}")
+    return points
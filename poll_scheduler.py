@@ -0,0 +1,115 @@
+import heapq
+import time
+from typing import Iterable, List
+from circuit_breaker import backoff_delay
+
+# Game minute after which a line stops moving, first half lines are over at half time
+FIRST_HALF_ACTIVE_UNTIL = {"1_5": 45, "1_6": 45}
+
+
+def is_market_active(active_until, game_time) -> bool:
+    if active_until is None:
+        return True
+    try:
+        return int(game_time) <= active_until
+    except (TypeError, ValueError):
+        return True
+
+
+class PollScheduler:
+    """
+    Priority queue of events keyed on the time their odds are next due.
+    The polling interval of an event shrinks with the recent line volatility of its active markets,
+    starting from a longer base interval for prelive events than for in-play ones.
+    An event whose odds fetch failed is retried with an exponential backoff, up to max_retry_interval.
+    """
+
+    def __init__(self, inplay_interval: float = 5, prelive_interval: float = 30, min_interval: float = 1,
+                 max_interval: float = 60, smoothing: float = 0.3, active_until: dict = None,
+                 max_retry_interval: float = 300):
+        self.inplay_interval = inplay_interval
+        self.prelive_interval = prelive_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.max_retry_interval = max_retry_interval
+        # line type -> game minute after which its moves no longer count towards the volatility
+        self.active_until = active_until if active_until is not None else FIRST_HALF_ACTIVE_UNTIL
+
+        self.heap = []  # (due_at, event_id), entries which no longer match next_due are skipped
+        self.next_due = {}
+        self.last_polled_at = {}
+        self.line_moves = {}  # line moves per event and line type since the last poll
+        self.volatility = {}  # moving average of line moves per minute per event and line type
+        self.failures = {}  # failed odds fetches in a row per event
+
+    def record_line_move(self, event_id: str, line_type: str):
+        moves = self.line_moves.setdefault(event_id, {})
+        moves[line_type] = moves.get(line_type, 0) + 1
+
+    def pop_due(self, event_ids: Iterable, now: float = None) -> List[str]:
+        """Events of event_ids due for an odds fetch, never polled events first and then the most overdue."""
+        now = time.time() if now is None else now
+        eligible = set(event_ids)
+        due = [event_id for event_id in eligible if event_id not in self.next_due]
+
+        # Due events which are not eligible this cycle (e.g. after a goal) stay due for the next one
+        deferred = []
+        while self.heap and self.heap[0][0] <= now:
+            due_at, event_id = heapq.heappop(self.heap)
+            if self.next_due.get(event_id) != due_at:
+                continue
+            if event_id in eligible:
+                del self.next_due[event_id]
+                due.append(event_id)
+            else:
+                deferred.append((due_at, event_id))
+        for item in deferred:
+            heapq.heappush(self.heap, item)
+
+        return due
+
+    def interval(self, event_id: str, game_time) -> float:
+        base_interval = self.prelive_interval if game_time in (None, "Prelive") else self.inplay_interval
+        volatility = sum(moves_per_minute for line_type, moves_per_minute in self.volatility.get(event_id, {}).items()
+                         if is_market_active(self.active_until.get(line_type), game_time))
+        return min(self.max_interval, max(self.min_interval, base_interval / (1 + volatility)))
+
+    def schedule(self, event_id: str, game_time, now: float = None) -> float:
+        """Update the volatility of the event from the line moves since its last poll and queue its next poll."""
+        now = time.time() if now is None else now
+        last_polled_at = self.last_polled_at.get(event_id)
+        moves = self.line_moves.pop(event_id, {})
+        if last_polled_at is not None and now > last_polled_at:
+            minutes = (now - last_polled_at) / 60
+            volatility = self.volatility.setdefault(event_id, {})
+            for line_type in set(volatility) | set(moves):
+                rate = moves.get(line_type, 0) / minutes
+                volatility[line_type] = self.smoothing * rate + (1 - self.smoothing) * volatility.get(line_type, rate)
+        self.last_polled_at[event_id] = now
+        self.failures.pop(event_id, None)
+        return self.queue(event_id, now + self.interval(event_id, game_time))
+
+    def schedule_retry(self, event_id: str, game_time, now: float = None) -> float:
+        """Queue the next poll of an event whose odds fetch failed, backing off with every failure in a row."""
+        now = time.time() if now is None else now
+        failures = self.failures[event_id] = self.failures.get(event_id, 0) + 1
+        interval = self.interval(event_id, game_time)
+        return self.queue(event_id, now + max(interval, backoff_delay(failures, interval, self.max_retry_interval)))
+
+    def queue(self, event_id: str, due_at: float) -> float:
+        self.next_due[event_id] = due_at
+        heapq.heappush(self.heap, (due_at, event_id))
+
+        # Drop the stale heap entries once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.next_due) + 64:
+            self.heap = [(due, event) for event, due in self.next_due.items()]
+            heapq.heapify(self.heap)
+        return due_at
+
+    def remove(self, event_id: str):
+        self.next_due.pop(event_id, None)
+        self.last_polled_at.pop(event_id, None)
+        self.line_moves.pop(event_id, None)
+        self.volatility.pop(event_id, None)
+        self.failures.pop(event_id, None)
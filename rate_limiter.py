@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+
+class RequestBudget:
+    """
+    Token bucket over the BetsAPI hourly request quota, shared by every api call.
+    Tokens refill evenly through the hour so requests are spread out instead of bursting,
+    and when callers have to wait the one with the lowest priority value is served first.
+    """
+
+    def __init__(self, requests_per_hour: int = 195000, burst: float = None):
+        self.requests_per_hour = requests_per_hour
+        self.burst = burst
+        self.rate = requests_per_hour / 3600
+        self.capacity = burst if burst is not None else max(1.0, self.rate * 2)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+        self.waiters = []  # heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+        self.wakeup = None
+
+        # Requests actually made, counted per minute for the last hour
+        self.spend_by_minute = deque()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def set_rate(self, requests_per_hour: int):
+        """Change the hourly quota, e.g. when it is split between more or fewer detector workers."""
+        self.refill()
+        self.requests_per_hour = requests_per_hour
+        self.rate = requests_per_hour / 3600
+        self.capacity = self.burst if self.burst is not None else max(1.0, self.rate * 2)
+        self.tokens = min(self.tokens, self.capacity)
+        # Waiters are woken at the new rate
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+            self.wakeup = None
+        self.schedule_wakeup()
+
+    def record_spend(self):
+        minute = int(time.time() // 60)
+        if self.spend_by_minute and self.spend_by_minute[-1][0] == minute:
+            self.spend_by_minute[-1][1] += 1
+        else:
+            self.spend_by_minute.append([minute, 1])
+        while self.spend_by_minute and self.spend_by_minute[0][0] <= minute - 60:
+            self.spend_by_minute.popleft()
+
+    def spent_last_hour(self) -> int:
+        minute = int(time.time() // 60)
+        return sum(count for spend_minute, count in self.spend_by_minute if spend_minute > minute - 60)
+
+    async def acquire(self, priority: int = 0):
+        """Wait for a request token, lower priority values are served first."""
+        self.refill()
+        if not self.waiters and self.tokens >= 1:
+            self.tokens -= 1
+            self.record_spend()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        self.schedule_wakeup()
+        await future
+
+    def schedule_wakeup(self):
+        if self.wakeup is not None or not self.waiters:
+            return
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        self.wakeup = asyncio.get_running_loop().call_later(delay, self.release_waiters)
+
+    def release_waiters(self):
+        self.wakeup = None
+        self.refill()
+        while self.waiters and self.tokens >= 1:
+            priority, sequence, future = heapq.heappop(self.waiters)
+            if future.done():  # cancelled while waiting
+                continue
+            self.tokens -= 1
+            self.record_spend()
+            future.set_result(None)
+        self.schedule_wakeup()
+
+    def stats(self) -> dict:
+        return {
+            "spent_last_hour": self.spent_last_hour(),
+            "hourly_budget": self.requests_per_hour,
+            "tokens": round(self.tokens, 2),
+            "waiting": len(self.waiters)
+        }
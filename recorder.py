@@ -0,0 +1,64 @@
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Iterator
+
+
+class ResponseRecorder:
+    """
+    Records raw BetsAPI responses with the time they were received to gzip compressed JSON lines files,
+    a new file is started every rotate_seconds. The api token is never written.
+    """
+
+    def __init__(self, directory: str, rotate_seconds: int = 60 * 60):
+        self.directory = directory
+        self.rotate_seconds = rotate_seconds
+        self.file = None
+        self.file_started_at = None
+        os.makedirs(directory, exist_ok=True)
+
+    def open_file(self, now: float):
+        if self.file is not None:
+            self.file.close()
+        file_name = time.strftime("betsapi-%Y%m%d-%H%M%S.jsonl.gz", time.gmtime(now))
+        self.file = gzip.open(os.path.join(self.directory, file_name), "at", compresslevel=5)
+        self.file_started_at = now
+
+    def record(self, url: str, params: dict, status: int, body: bytes):
+        now = time.time()
+        try:
+            if self.file is None or now - self.file_started_at >= self.rotate_seconds:
+                self.open_file(now)
+            self.file.write(json.dumps({
+                "t": now,
+                "url": url,
+                "params": {key: value for key, value in (params or {}).items() if key != "token"},
+                "status": status,
+                "body": body.decode("utf-8", errors="replace")
+            }) + "\n")
+        except OSError as e:
+            logging.error(f"In Recording Response | {url} | {e}")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_recording(paths: list) -> Iterator[dict]:
+    """Recorded responses of all the given files in the order they were received."""
+    records = []
+    for path in paths:
+        try:
+            with gzip.open(path, "rt") as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        records.append(json.loads(line))
+        except (EOFError, ValueError, OSError) as e:
+            # A recording which was still being written when the bot stopped ends with a partial line
+            logging.warning(f"Recording read up to the error | {path} | {e}")
+    records.sort(key=lambda record: record["t"])
+    return iter(records)
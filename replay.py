@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+import statistics
+import time
+from urllib.request import urlopen
+from telegram import Bot
+from telegram.request import HTTPXRequest
+from bot import LineChangeDetector
+from alert_aggregator import AlertAggregator
+from feed_source import StreamingFeed
+from alert_outbox import AlertOutbox
+from poll_scheduler import PollScheduler
+from recorder import read_recording
+from stub_server import StubFeed, StubServer
+
+
+class RecordedFeed(StubFeed):
+    """
+    Serves the responses of a recording as they were at the replay clock.
+    Odds data points become visible from the time they were first recorded, so the detector sees
+    the same history whether it polls more or less often than the recorded bot did.
+    """
+
+    def __init__(self, paths: list):
+        self.events_times = []
+        self.events_bodies = []
+        self.odds = {}  # event_id -> line_type -> ([first seen time], [data point]), oldest first
+        seen_ids = {}
+        self.end_time = 0.0
+        for record in read_recording(paths):
+            self.end_time = record["t"]
+            if record["status"] != 200:
+                continue
+            try:
+                body = json.loads(record["body"])
+            except ValueError:
+                continue
+            event_id = record["params"].get("event_id")
+            if event_id is None:
+                self.events_times.append(record["t"])
+                self.events_bodies.append(body)
+                continue
+
+            event_odds = self.odds.setdefault(str(event_id), {})
+            for line_type, points in ((body.get("results") or {}).get("odds") or {}).items():
+                first_seen, line_points = event_odds.setdefault(line_type, ([], []))
+                line_seen_ids = seen_ids.setdefault((str(event_id), line_type), set())
+                for point in reversed(points):
+                    if point.get("id") not in line_seen_ids:
+                        line_seen_ids.add(point.get("id"))
+                        first_seen.append(record["t"])
+                        line_points.append(point)
+        self.clock = self.events_times[0] if self.events_times else 0.0
+
+    def live_events(self) -> dict:
+        index = bisect.bisect_right(self.events_times, self.clock) - 1
+        if index < 0:
+            return {"success": 1, "results": []}
+        return self.events_bodies[index]
+
+    def event_odds(self, event_id: str, since_time: int = None) -> dict:
+        odds = {}
+        for line_type, (first_seen, line_points) in self.odds.get(event_id, {}).items():
+            visible = line_points[:bisect.bisect_right(first_seen, self.clock)]
+            if since_time is not None:
+                visible = [point for point in visible if int(point["add_time"]) >= since_time]
+            odds[line_type] = visible[::-1]
+        return {"success": 1, "results": {"odds": odds}}
+
+
+def make_offline_detector(base_url: str, fast: bool = True, max_concurrent_requests: int = 20,
+                          alert_coalesce_seconds: float = None, stream: bool = False):
+    """A detector wired to a StubServer, the BetsAPI and Telegram calls all go to base_url."""
+    for channel in ("LOGS_CHANNEL", "SOFT_ALERTS_CHANNEL", "MEDIUM_ALERTS_CHANNEL", "HARD_ALERTS_CHANNEL"):
+        os.environ.setdefault(channel, f"-100{len(channel)}")
+    t_request = HTTPXRequest(connection_pool_size=25)
+    bots = {
+        "alerts": Bot(token="alerts", base_url=f"{base_url}/bot", request=t_request),
+        "logs": Bot(token="logs", base_url=f"{base_url}/bot", request=t_request)
+    }
+    # The stub does not rate limit, so neither does the outbox
+    alert_outbox = AlertOutbox(bots=bots, max_size=100000, chat_interval=0, chat_messages_per_minute=10 ** 6,
+                               global_messages_per_second=10 ** 6)
+    # As fast as possible replays poll every eligible event on every cycle
+    poll_scheduler = PollScheduler(inplay_interval=0, prelive_interval=0, min_interval=0) if fast else None
+    return LineChangeDetector(events_api_url=f"{base_url}/events",
+                              odds_api_url=f"{base_url}/odds",
+                              feed_source=StreamingFeed(f"{base_url}/stream", "replay") if stream else None,
+                              betsapi_token="replay",
+                              max_concurrent_requests=max_concurrent_requests,
+                              alert_outbox=alert_outbox,
+                              poll_scheduler=poll_scheduler,
+                              alert_aggregator=(AlertAggregator(alert_outbox, window=alert_coalesce_seconds)
+                                                if alert_coalesce_seconds is not None else None))
+
+
+def control(base_url: str, path: str) -> dict:
+    with urlopen(f"{base_url}/control/{path}") as response:
+        return json.load(response)
+
+
+def summarise(cycle_latencies: list) -> dict:
+    if not cycle_latencies:
+        return {"cycles": 0}
+    latencies = sorted(cycle_latencies)
+    return {
+        "cycles": len(latencies),
+        "cycle_mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "cycle_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "cycle_p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+        "cycle_max_ms": round(latencies[-1] * 1000, 2)
+    }
+
+
+async def replay(paths: list, speed: float = 0.0, cycle_seconds: float = 1.0,
+                 alert_coalesce_seconds: float = None, stream: bool = False) -> dict:
+    """
+    Feed a recording back through LineChangeDetector.process.
+    speed 0 runs one cycle per recorded events response as fast as possible,
+    otherwise the recording is played back at speed times real time.
+    """
+    stub = StubServer(RecordedFeed, paths).start()
+    try:
+        feed = RecordedFeed(paths)  # the stub serves its own copy, this one only drives the clock
+        if not feed.events_times:
+            raise ValueError("No events api responses in the recording")
+        detector = make_offline_detector(stub.base_url, fast=speed == 0,
+                                         alert_coalesce_seconds=alert_coalesce_seconds, stream=stream)
+        detector.alert_outbox.start()
+        detector.feed_source.start(detector)
+
+        # A recorded cycle's odds responses arrive after its events response, so as fast as possible replays
+        # run each cycle with the clock just before the next recorded events response
+        cycle_ends = [events_time - 1e-6 for events_time in feed.events_times[1:]] + [feed.end_time]
+        cycle_latencies = []
+        replay_started_at = time.monotonic()
+        clock = cycle_ends[0] if speed == 0 else feed.events_times[0]
+        events_index = 0
+        while clock <= feed.end_time:
+            control(stub.base_url, f"clock?t={clock}")
+            cycle_started_at = time.perf_counter()
+            try:
+                _, current_events = await detector.process()
+                detector.clean_events(current_events)
+            except Exception as e:
+                logging.error(f"In Replay Cycle | {clock} | {e}")
+            cycle_latencies.append(time.perf_counter() - cycle_started_at)
+
+            if speed == 0:
+                events_index += 1
+                if events_index >= len(cycle_ends):
+                    break
+                clock = cycle_ends[events_index]
+            else:
+                await asyncio.sleep(max(0.0, cycle_seconds / speed - (time.perf_counter() - cycle_started_at)))
+                clock = feed.events_times[0] + (time.monotonic() - replay_started_at) * speed
+
+        await detector.feed_source.stop()
+        if detector.alert_aggregator is not None:
+            detector.alert_aggregator.drain()
+        await detector.alert_outbox.stop()
+        await detector.http_client.aclose()
+        report = summarise(cycle_latencies)
+        report["alert_outbox"] = detector.alert_outbox.stats()
+        if stream:
+            report["odds_stream"] = detector.feed_source.stats()
+        if detector.alert_aggregator is not None:
+            report["alert_aggregator"] = detector.alert_aggregator.stats()
+        report["stub"] = control(stub.base_url, "stats")
+        return report
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded BetsAPI responses through the detector offline.")
+    parser.add_argument("recordings", nargs="+", help="recording files or directories written with RECORD_DIR")
+    parser.add_argument("--speed", type=float, default=0.0, help="playback speed, 0 for as fast as possible")
+    parser.add_argument("--cycle-seconds", type=float, default=1.0, help="seconds between cycles at speed 1")
+    parser.add_argument("--coalesce-seconds", type=float, default=None,
+                        help="merge the alerts of an event as ALERT_COALESCE_SECONDS does, off by default")
+    parser.add_argument("--stream", action="store_true",
+                        help="take the odds from the stub's server-sent events feed as ODDS_STREAM_URL does, "
+                             "needs a --speed above 0")
+    args = parser.parse_args()
+    if args.stream and args.speed <= 0:
+        parser.error("--stream replays in real time, give a --speed above 0")
+
+    recording_paths = []
+    for recording in args.recordings:
+        if os.path.isdir(recording):
+            recording_paths.extend(sorted(glob.glob(os.path.join(recording, "*.jsonl.gz"))))
+        else:
+            recording_paths.append(recording)
+
+    print(json.dumps(asyncio.run(replay(recording_paths, args.speed, args.cycle_seconds,
+                                           args.coalesce_seconds, args.stream)), indent=2))
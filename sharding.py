@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List
+from alert_aggregator import AlertAggregator
+from alert_outbox import AlertOutbox
+from blacklist import Blacklist
+from event_lifecycle import EventLifecycle
+from incidents import SuspensionManager
+from log_setup import setup_logging
+from markets import MarketRegistry
+from metrics import Metrics
+from poll_scheduler import PollScheduler
+from rate_limiter import RequestBudget
+from recorder import ResponseRecorder
+from state_store import StateStore
+
+
+def rendezvous_owner(event_id: str, worker_ids: list) -> int:
+    """
+    Worker which owns an event, by highest random weight hashing.
+    When a worker starts or stops only the events it gains or loses change owner.
+    """
+    return max(worker_ids, key=lambda worker_id: zlib.crc32(f"{worker_id}:{event_id}".encode()))
+
+
+class ForwardingOutbox:
+    """Stands in for the AlertOutbox in a worker process, messages go to the coordinator's outbox."""
+
+    def __init__(self, alert_queue):
+        self.alert_queue = alert_queue
+        self.enqueued = Counter()
+
+    def enqueue(self, bot_name: str, **message) -> bool:
+        self.alert_queue.put((bot_name, message))
+        self.enqueued[bot_name] += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"enqueued": dict(self.enqueued)}
+
+
+def run_worker(worker_id: int, config: dict, task_queue, result_queue, alert_queue):
+    # Ctrl-C and e.g. a systemd stop reach the whole process group, the coordinator stops the workers once it has
+    # released their events
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if config.get("logging") is not None:
+        log_config = dict(config["logging"])
+        log_config["log_file"] = f"{log_config['log_file']}.worker{worker_id}"
+        setup_logging(**log_config)
+    asyncio.run(worker_loop(worker_id, config, task_queue, result_queue, alert_queue))
+
+
+async def worker_loop(worker_id: int, config: dict, task_queue, result_queue, alert_queue):
+    # Imported here as bot.py imports this module when it runs the coordinator
+    from bot import LineChangeDetector
+
+    markets = MarketRegistry.load(config.get("markets_file"))
+    alert_outbox = ForwardingOutbox(alert_queue)
+    # Observed here and merged into the coordinator's metrics with every cycle's reply
+    metrics = Metrics() if config.get("metrics") else None
+    coalesce_seconds = config.get("alert_coalesce_seconds")
+    detector = LineChangeDetector(**config["detector"],
+                                  alert_outbox=alert_outbox,
+                                  alert_aggregator=(AlertAggregator(alert_outbox, window=coalesce_seconds)
+                                                    if coalesce_seconds is not None else None),
+                                  request_budget=RequestBudget(requests_per_hour=config["requests_per_hour"]),
+                                  poll_scheduler=PollScheduler(inplay_interval=config["inplay_interval"],
+                                                               prelive_interval=config["prelive_interval"],
+                                                               active_until=markets.active_until()),
+                                  blacklist=Blacklist(config["blacklist_file"]) if config["blacklist_file"] else None,
+                                  recorder=ResponseRecorder(config["record_dir"]) if config["record_dir"] else None,
+                                  markets=markets,
+                                  metrics=metrics,
+                                  suspensions=SuspensionManager(windows=config.get("suspension_windows")))
+    # Every worker checkpoints its own events into the shared WAL database
+    state_store = StateStore(config["state_db_file"]) if config["state_db_file"] else None
+    # Events of this worker, kept for the grace period when they are missing from the live events
+    lifecycle = EventLifecycle(grace_seconds=config.get("event_grace_seconds", 120),
+                               max_events=config.get("max_tracked_events", 20000))
+    logging.info(f"Detector Worker {worker_id} started")
+
+    while True:
+        task = await asyncio.to_thread(task_queue.get)
+        if task is None:
+            break
+        kind, sequence = task[0], task[1]
+
+        if kind == "budget":
+            detector.http_client.request_budget.set_rate(task[2])
+
+        elif kind == "release":
+            event_ids = set(task[2])
+            states = {event_id: state for event_id, state in detector.export_state().items() if event_id in event_ids}
+            lifecycle.forget(event_ids)
+            detector.clean_events(lifecycle.tracked())
+            if state_store is not None:
+                state_store.forget(event_ids)
+            result_queue.put(("released", sequence, worker_id, states))
+
+        elif kind == "process":
+            events, states = task[2], task[3]
+            event_count = 0
+            try:
+                # Events new to this worker carry on from the state handed over or, failing that, the last checkpoint
+                if state_store is not None:
+                    gained = [event["id"] for event in events
+                              if event["id"] not in lifecycle.last_seen and event["id"] not in states]
+                    if gained:
+                        states = {**state_store.load_events(gained), **states}
+                detector.restore_state(states)
+
+                event_count, current_events = await detector.process(events)
+                detector.clean_events(lifecycle.observe(current_events))
+                if state_store is not None:
+                    await state_store.checkpoint(detector.export_changed_state(), detector.event_states)
+            except Exception as e:
+                logging.error(f"In Detector Worker | {worker_id} | {e}")
+            result_queue.put(("processed", sequence, worker_id,
+                              (event_count, metrics.collect() if metrics is not None else None)))
+
+    if detector.alert_aggregator is not None:
+        detector.alert_aggregator.drain()
+    await detector.http_client.aclose()
+    if state_store is not None:
+        await state_store.checkpoint(detector.export_changed_state(), detector.event_states, write_all=True)
+        state_store.close()
+    logging.info(f"Detector Worker {worker_id} stopped")
+
+
+class ShardedDetector:
+    """
+    Coordinator of a detector split over worker processes.
+    It fetches the live events once per cycle and hands each worker the events it owns, the workers fetch odds
+    and run detection for their events and send every Telegram message back to the one shared alert outbox.
+    When a worker starts or stops its events are rebalanced, with their detector state handed to the new owner.
+    worker_config["requests_per_hour"] is the request budget of all workers together, split evenly between them.
+    """
+
+    def __init__(self, fetcher, alert_outbox: AlertOutbox, worker_config: dict, workers: int = 2,
+                 cycle_timeout: float = 120, metrics: Metrics = None):
+        self.fetcher = fetcher  # a LineChangeDetector, only used for fetch_live_events
+        self.alert_outbox = alert_outbox
+        self.metrics = metrics
+        self.worker_config = dict(worker_config, metrics=metrics is not None)
+        self.requests_per_hour = worker_config["requests_per_hour"]
+        self.worker_count = workers
+        self.cycle_timeout = cycle_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.result_queue = self.context.Queue()
+        self.alert_queue = self.context.Queue()
+        self.workers = {}  # worker_id -> (process, task_queue)
+        self.next_worker_id = 0
+        self.sequence = 0
+        self.owners = {}  # event_id -> worker_id of the last cycle
+        self.pending_states = {}  # states released by stopped workers, waiting for their new owners
+        self.forwarder = None
+        self.stopping = False
+
+    def start_worker(self) -> int:
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        task_queue = self.context.Queue()
+        config = dict(self.worker_config, requests_per_hour=self.worker_budget())
+        process = self.context.Process(target=run_worker, name=f"detector-worker-{worker_id}",
+                                       args=(worker_id, config, task_queue, self.result_queue, self.alert_queue))
+        process.start()
+        self.workers[worker_id] = (process, task_queue)
+        return worker_id
+
+    def worker_budget(self) -> int:
+        return self.requests_per_hour // max(self.worker_count, 1)
+
+    def start(self):
+        for _ in range(self.worker_count):
+            self.start_worker()
+        self.forwarder = asyncio.create_task(self.forward_alerts())
+
+    async def forward_alerts(self):
+        while not self.stopping:
+            try:
+                bot_name, message = await asyncio.to_thread(self.alert_queue.get, True, 0.5)
+            except queue.Empty:
+                continue
+            self.alert_outbox.enqueue(bot_name, **message)
+
+    async def collect(self, kind: str, sequence: int, worker_ids: set) -> dict:
+        """Wait for the replies of the workers to the task of this sequence number."""
+        replies = {}
+        deadline = time.monotonic() + self.cycle_timeout
+        while worker_ids - replies.keys():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.error(f"Detector Workers did not reply in time | {kind} | {worker_ids - replies.keys()}")
+                break
+            try:
+                reply_kind, reply_sequence, worker_id, payload = await asyncio.to_thread(
+                    self.result_queue.get, True, min(remaining, 1.0))
+            except queue.Empty:
+                # A worker which died mid-cycle will never reply
+                worker_ids = {worker_id for worker_id in worker_ids
+                              if worker_id in self.workers and self.workers[worker_id][0].is_alive()}
+                continue
+            if reply_kind == kind and reply_sequence == sequence:
+                replies[worker_id] = payload
+        return replies
+
+    async def release(self, releases: Dict[int, List[str]]) -> dict:
+        """Take the events away from their current workers and return the detector state of those events."""
+        self.sequence += 1
+        for worker_id, event_ids in releases.items():
+            self.workers[worker_id][1].put(("release", self.sequence, event_ids))
+        states = {}
+        for worker_states in (await self.collect("released", self.sequence, set(releases))).values():
+            states.update(worker_states)
+        return states
+
+    async def stop_worker(self, worker_id: int):
+        """Stop a worker, its events move to the other workers from the next cycle on."""
+        event_ids = [event_id for event_id, owner in self.owners.items() if owner == worker_id]
+        if event_ids:
+            self.pending_states.update(await self.release({worker_id: event_ids}))
+        process, task_queue = self.workers.pop(worker_id)
+        task_queue.put(None)
+        await asyncio.to_thread(process.join, 30)
+        if process.is_alive():
+            process.kill()
+
+    async def resize(self, workers: int):
+        """Start or stop workers to run that many, their events are rebalanced in the next cycle."""
+        workers = max(1, workers)
+        if workers == len(self.workers):
+            return
+        logging.info(f"Detector Workers resized from {len(self.workers)} to {workers}")
+        self.worker_count = workers
+        # The running workers get their new share of the request budget before more workers start and after
+        # workers stop, so the workers together never go over it
+        if workers > len(self.workers):
+            self.send_budget()
+            while len(self.workers) < workers:
+                self.start_worker()
+        else:
+            for worker_id in sorted(self.workers, reverse=True)[:len(self.workers) - workers]:
+                await self.stop_worker(worker_id)
+            self.send_budget()
+
+    def send_budget(self):
+        self.sequence += 1
+        for _, task_queue in self.workers.values():
+            task_queue.put(("budget", self.sequence, self.worker_budget()))
+
+    def replace_dead_workers(self):
+        for worker_id, (process, _) in list(self.workers.items()):
+            if not process.is_alive():
+                # The state of its events is lost, their new owners carry on from the last checkpoint
+                logging.error(f"Detector Worker {worker_id} died with exit code {process.exitcode}, replacing it")
+                del self.workers[worker_id]
+                self.start_worker()
+
+    async def process(self):
+        self.replace_dead_workers()
+        live_events = await self.fetcher.fetch_live_events()
+        live_events = [event for event in live_events if event.get("id")]
+
+        worker_ids = sorted(self.workers)
+        assignment = {event["id"]: rendezvous_owner(event["id"], worker_ids) for event in live_events}
+
+        # Events moving between two running workers take their detector state with them
+        handoff_states, self.pending_states = self.pending_states, {}
+        releases = {}
+        for event_id, worker_id in assignment.items():
+            previous_owner = self.owners.get(event_id)
+            if previous_owner is not None and previous_owner != worker_id and previous_owner in self.workers:
+                releases.setdefault(previous_owner, []).append(event_id)
+        if releases:
+            handoff_states.update(await self.release(releases))
+
+        # Every worker gets a task, an empty one lets it drop the events it no longer owns
+        slices = {worker_id: [] for worker_id in worker_ids}
+        for event in live_events:
+            slices[assignment[event["id"]]].append(event)
+        self.sequence += 1
+        for worker_id, events in slices.items():
+            states = {event["id"]: handoff_states[event["id"]] for event in events if event["id"] in handoff_states}
+            self.workers[worker_id][1].put(("process", self.sequence, events, states))
+        replies = await self.collect("processed", self.sequence, set(slices))
+
+        self.owners = assignment
+        event_count = 0
+        for worker_event_count, worker_metrics in replies.values():
+            event_count += worker_event_count
+            if worker_metrics is not None and self.metrics is not None:
+                self.metrics.merge(worker_metrics)
+        return event_count, list(assignment)
+
+    def clean_events(self, event_list: Iterable):
+        keep = event_list if isinstance(event_list, (set, frozenset)) else set(event_list)
+        for event_id in [event_id for event_id in self.pending_states if event_id not in keep]:
+            del self.pending_states[event_id]
+
+    async def stop(self):
+        for worker_id in list(self.workers):
+            process, task_queue = self.workers.pop(worker_id)
+            task_queue.put(None)
+            await asyncio.to_thread(process.join, 30)
+            if process.is_alive():
+                process.kill()
+        self.stopping = True
+        if self.forwarder is not None:
+            await self.forwarder
+        # Messages sent by the workers just before they stopped
+        while True:
+            try:
+                bot_name, message = self.alert_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.alert_outbox.enqueue(bot_name, **message)
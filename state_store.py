@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Iterable
+
+
+class StateStore:
+    """
+    Crash safe SQLite (WAL mode) store of the per event detector state.
+    Each checkpoint only writes the events whose state changed since they were last written,
+    at most max_writes rows per checkpoint, the rest follow in the next checkpoints.
+    Rows expire max_age seconds after their event was last tracked, the rows of quiet events which are still
+    tracked are touched every touch_interval seconds so they survive a restart.
+    """
+
+    def __init__(self, path: str, max_writes: int = 500, max_age: int = 30 * 60, touch_interval: float = None):
+        self.path = path
+        self.max_writes = max_writes
+        self.max_age = max_age  # older rows are too stale to carry on from after a restart
+        self.touch_interval = touch_interval if touch_interval is not None else max_age / 3
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS event_state ("
+                                "event_id TEXT PRIMARY KEY, "
+                                "state TEXT NOT NULL, "
+                                "updated_at REAL NOT NULL)")
+        self.written = {}  # event_id -> state json as last written
+        self.written_at = {}  # event_id -> time its row was last written or touched
+        self.pending = {}  # event_id -> state json changed but not written yet
+
+    def load(self) -> dict:
+        """Read back the state of every event checkpointed within max_age seconds."""
+        started_at = time.perf_counter()
+        rows = self.connection.execute("SELECT event_id, state, updated_at FROM event_state WHERE updated_at >= ?",
+                                       (time.time() - self.max_age,)).fetchall()
+        states = {}
+        for event_id, state, updated_at in rows:
+            try:
+                states[event_id] = json.loads(state)
+                self.written[event_id] = state
+                self.written_at[event_id] = updated_at
+            except ValueError as e:
+                logging.error(f"In Loading State | {event_id} | {e}")
+        self.prune()
+        logging.info(f"Loaded state of {len(states)} events in {(time.perf_counter() - started_at) * 1000:.1f}ms")
+        return states
+
+    def prune(self):
+        """Delete the rows too old to be restored."""
+        self.connection.execute("DELETE FROM event_state WHERE updated_at < ?", (time.time() - self.max_age,))
+
+    def load_events(self, event_ids: list) -> dict:
+        """Read back the checkpointed state of the given events, e.g. events handed to another worker process."""
+        states = {}
+        event_ids = list(event_ids)
+        for start in range(0, len(event_ids), 500):
+            chunk = event_ids[start:start + 500]
+            rows = self.connection.execute(f"SELECT event_id, state, updated_at FROM event_state "
+                                           f"WHERE updated_at >= ? AND event_id IN ({','.join('?' * len(chunk))})",
+                                           (time.time() - self.max_age, *chunk)).fetchall()
+            for event_id, state, updated_at in rows:
+                try:
+                    states[event_id] = json.loads(state)
+                    self.written[event_id] = state
+                    self.written_at[event_id] = updated_at
+                except ValueError as e:
+                    logging.error(f"In Loading State | {event_id} | {e}")
+        return states
+
+    def forget(self, event_ids):
+        """Stop tracking events now owned by another process, without deleting their rows."""
+        for event_id in event_ids:
+            self.written.pop(event_id, None)
+            self.written_at.pop(event_id, None)
+            self.pending.pop(event_id, None)
+
+    async def checkpoint(self, states: dict, tracked: Iterable, write_all: bool = False):
+        """
+        Persist the given changed event states, keep the rows of the tracked events from expiring and drop the
+        rows of the events which are no longer tracked. write_all writes every change now, e.g. before stopping.
+        """
+        for event_id, state in states.items():
+            try:
+                self.pending[event_id] = json.dumps(state, separators=(',', ':'), default=str)
+            except (TypeError, ValueError) as e:
+                logging.error(f"In Saving State | {event_id} | {e}")
+        tracked = tracked if isinstance(tracked, (set, frozenset, dict)) else set(tracked)
+
+        upserts = []
+        for event_id in list(self.pending):
+            if not write_all and len(upserts) >= self.max_writes:
+                break
+            state_json = self.pending.pop(event_id)
+            if event_id in tracked and self.written.get(event_id) != state_json:
+                upserts.append((event_id, state_json))
+        upserted = {event_id for event_id, _ in upserts}
+        touch_before = time.time() - self.touch_interval
+        touches = [event_id for event_id, written_at in self.written_at.items()
+                   if written_at < touch_before and event_id in tracked and event_id not in upserted]
+        deletes = [event_id for event_id in self.written if event_id not in tracked]
+        if not upserts and not touches and not deletes:
+            return
+
+        now = await asyncio.to_thread(self.write, upserts, touches, deletes)
+        for event_id, state_json in upserts:
+            self.written[event_id] = state_json
+            self.written_at[event_id] = now
+        for event_id in touches:
+            self.written_at[event_id] = now
+        for event_id in deletes:
+            del self.written[event_id]
+            self.written_at.pop(event_id, None)
+            self.pending.pop(event_id, None)
+
+    def write(self, upserts: list, touches: list, deletes: list) -> float:
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT INTO event_state (event_id, state, updated_at) VALUES (?, ?, ?) "
+                                        "ON CONFLICT(event_id) DO UPDATE SET state = excluded.state, "
+                                        "updated_at = excluded.updated_at",
+                                        [(event_id, state_json, now) for event_id, state_json in upserts])
+            self.connection.executemany("UPDATE event_state SET updated_at = ? WHERE event_id = ?",
+                                        [(now, event_id) for event_id in touches])
+            self.connection.executemany("DELETE FROM event_state WHERE event_id = ?",
+                                        [(event_id,) for event_id in deletes])
+        return now
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,162 @@
+import json
+import multiprocessing
+import zlib
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubFeed(ABC):
+    """Data served by the stub server, implemented by the replay and benchmark feeds."""
+
+    def set_clock(self, clock: float):
+        self.clock = clock
+
+    @abstractmethod
+    def live_events(self) -> dict:
+        """The live events as of the clock, in the format of the BetsAPI inplay endpoint."""
+
+    @abstractmethod
+    def event_odds(self, event_id: str, since_time: int = None) -> dict:
+        """The odds of an event as of the clock, in the format of the BetsAPI event odds endpoint."""
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    /events and /odds answer like the BetsAPI inplay and event odds endpoints,
+    /stream pushes the new odds data points of the live events as server-sent events as the clock advances,
+    /bot<token>/sendMessage like the Telegram Bot API and /control/* drives the stub itself.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status: int = 200, etag: bool = False):
+        body = json.dumps(data).encode()
+        headers = {"Content-Type": "application/json"}
+        if etag:
+            # Validator for conditional requests, an unchanged body is answered with 304 Not Modified
+            headers["ETag"] = f'"{zlib.crc32(body):08x}"'
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                status, body = 304, b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        server = self.server
+        server.requests += 1
+
+        if url.path == "/events":
+            self.send_json(server.feed.live_events(), etag=True)
+        elif url.path == "/odds":
+            since_time = int(params["since_time"]) if "since_time" in params else None
+            self.send_json(server.feed.event_odds(params.get("event_id"), since_time))
+        elif url.path == "/stream":
+            self.stream_odds(float(params.get("interval", 0.1)))
+        elif url.path == "/control/clock":
+            server.feed.set_clock(float(params["t"]))
+            self.send_json({"ok": True})
+        elif url.path == "/control/stats":
+            self.send_json({"requests": server.requests, "messages": server.messages})
+        else:
+            self.send_json({"success": 0, "error": "not found"}, status=404)
+
+    def stream_odds(self, interval: float, keep_alive: float = 5.0):
+        """Every interval, push the data points added since the last push, as the StreamingFeed expects them."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        feed = self.server.feed
+        sent = {}  # (event_id, line_type) -> id of the latest data point pushed
+        last_write_at = time.monotonic()
+        try:
+            while True:
+                messages = []
+                for event in feed.live_events().get("results", []):
+                    event_id = event.get("id")
+                    odds = {}
+                    for line_type, points in feed.event_odds(event_id)["results"]["odds"].items():
+                        latest_id = sent.get((event_id, line_type))
+                        new_points = [point for point in points if latest_id is None or point["id"] > latest_id]
+                        if new_points:
+                            odds[line_type] = new_points
+                            sent[(event_id, line_type)] = new_points[0]["id"]
+                    if odds:
+                        messages.append(f"event: odds\ndata: {json.dumps({'event_id': event_id, 'odds': odds})}\n\n")
+                if messages:
+                    self.wfile.write("".join(messages).encode())
+                    last_write_at = time.monotonic()
+                elif time.monotonic() - last_write_at >= keep_alive:
+                    self.wfile.write(b": keep-alive\n\n")
+                    last_write_at = time.monotonic()
+                self.wfile.flush()
+                time.sleep(interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            data = json.loads(body or "{}")
+        else:
+            data = {key: values[0] for key, values in parse_qs(body).items()}
+
+        server = self.server
+        server.messages += 1
+        chat_id = data.get("chat_id", 0)
+        self.send_json({"ok": True, "result": {
+            "message_id": server.messages,
+            "date": int(time.time()),
+            "chat": {"id": chat_id if str(chat_id).lstrip("-").isdigit() else 0, "type": "channel"},
+            "text": data.get("text", "")
+        }})
+
+
+def serve(feed_factory, feed_args: tuple, port_pipe):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubRequestHandler)
+    server.daemon_threads = True
+    server.feed = feed_factory(*feed_args)
+    server.requests = 0
+    server.messages = 0
+    port_pipe.send(server.server_address[1])
+    server.serve_forever()
+
+
+class StubServer:
+    """Local stand-in for the BetsAPI and Telegram servers, run in its own process so it is not measured."""
+
+    def __init__(self, feed_factory, *feed_args):
+        self.feed_factory = feed_factory
+        self.feed_args = feed_args
+        self.process = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=serve, args=(self.feed_factory, self.feed_args, sender),
+                                               daemon=True)
+        self.process.start()
+        self.port = receiver.recv()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
@@ -0,0 +1,118 @@
+"""CircuitBreaker states on a fake clock: opening, the trial call, its outcomes and the backoff between trips."""
+import random
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, backoff_delay
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    # The open periods are the top of their jitter range
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+    return clock
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_failures_in_a_row(clock):
+    breaker = CircuitBreaker("api", failure_threshold=3, reset_timeout=5)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_in() == 5
+
+
+def test_one_trial_call_after_the_open_period(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, reset_timeout=5)
+    open_breaker(breaker)
+    clock.now += 4.9
+    assert not breaker.allow()
+    clock.now += 0.1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_failed_trial_reopens_for_twice_as_long_up_to_the_cap(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, reset_timeout=5, max_reset_timeout=15)
+    open_breaker(breaker)
+    open_periods = []
+    for _ in range(4):
+        open_periods.append(breaker.retry_in())
+        clock.now = breaker.opened_until
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+    assert open_periods == [5, 10, 15, 15]
+    clock.now = breaker.opened_until
+    breaker.allow()
+    breaker.record_success()
+    open_breaker(breaker)
+    assert breaker.retry_in() == 5
+
+
+def test_trial_which_never_reports_back_times_out(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, reset_timeout=5, trial_timeout=30)
+    open_breaker(breaker)
+    clock.now += 5
+    assert breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_released_trial_lets_the_next_trial_through(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, reset_timeout=5, trial_timeout=30)
+    open_breaker(breaker)
+    clock.now += 5
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_release_does_nothing_outside_a_trial(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, reset_timeout=5)
+    breaker.release()
+    assert breaker.state == CLOSED
+    open_breaker(breaker)
+    breaker.release()
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_transitions_are_counted(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, reset_timeout=5)
+    open_breaker(breaker)
+    clock.now += 5
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.stats()["transitions"] == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+
+def test_backoff_delay_is_capped(clock):
+    assert [backoff_delay(attempt, 1, 30) for attempt in range(7)] == [1, 2, 4, 8, 16, 30, 30]
@@ -0,0 +1,225 @@
+"""
+Equivalence of detect_changes with the nested scan it replaced, which for every new data point walked every
+cleaned data point of the last 150 seconds, latest first.
+Growing odds histories are fed through both, after every few new data points as a poll would see them, and the
+alerts, the range filter and goal logs and the cursors have to match. The histories are generated like the odds
+api data, with split lines, closed odds, goals and missing scores, so the test needs no recordings.
+"""
+import asyncio
+import random
+
+import pytest
+
+import bot
+from line_arrays import NUMPY_AVAILABLE
+from odds_points import parse_odds_points
+
+LINE_TYPES = ("1_2", "1_3", "1_5", "1_6")
+START_TIME = 1700000000
+
+
+def odds_history(seed: int, points: int = 300) -> dict:
+    """Data points per line type as returned by the odds api, oldest first."""
+    rnd = random.Random(seed)
+    history = {}
+    point_id = 10 ** 8 + seed * 10 ** 6
+    for line_type in LINE_TYPES:
+        data = []
+        add_time = START_TIME
+        line = rnd.choice([-1.0, -0.5, 0.0, 0.25, 2.5, 3.0])
+        goals = [0, 0]
+        for _ in range(points):
+            add_time += rnd.choice([1, 2, 3, 5, 8, 20, 40])
+            if rnd.random() < 0.12:
+                line += rnd.choice([-1.0, -0.75, -0.5, -0.25, 0.25, 0.5, 0.75, 1.0])
+            if rnd.random() < 0.01:
+                goals[rnd.randint(0, 1)] += 1
+            # Quarter lines are split lines, e.g. 0.75 is "0.5,1.0"
+            handicap = f"{line - 0.25},{line + 0.25}" if (line * 4) % 2 == 1 else f"{line}"
+            if line > 0 and rnd.random() < 0.3:
+                handicap = "+" + handicap
+            point_id += 1
+            odds = "-" if rnd.random() < 0.05 else "1.9"
+            point = {"id": str(point_id), "add_time": str(add_time), "handicap": handicap,
+                     "ss": f"{goals[0]}-{goals[1]}" if rnd.random() >= 0.02 else None,
+                     "time_str": str(min(90, (add_time - START_TIME) // 60))}
+            if line_type in ("1_2", "1_5"):
+                point.update(home_od=odds, away_od="1.9")
+            else:
+                point.update(over_od=odds, under_od="1.9")
+            data.append(point)
+        history[line_type] = data
+    return history
+
+
+class NestedScan:
+    """The detection loop of detect_changes before the sliding window, for one event."""
+
+    def __init__(self, goals: list, buffer_stop: int = None):
+        self.goals = goals
+        self.buffer_stop = buffer_stop
+        self.cursors = {}  # line_type -> (last processed id, its line)
+        self.alerts = {}  # alert level -> (from, to, direction) of the last alert
+
+    def detect(self, line_type: str, data: list) -> list:
+        events = []
+        if not data:
+            return events
+        if line_type not in self.cursors:
+            self.cursors[line_type] = (data[0].id, data[0].handicap)
+            return events
+        last_id, last_value = self.cursors[line_type]
+
+        new_data = [data[i - 1] for i in range(1, len(data) - 1)
+                    if data[i].handicap == data[i - 1].handicap and data[i].odds_open and data[i - 1].odds_open]
+        if not new_data:
+            return events
+        cleaned_data = [new_data[-1]]
+        for point in reversed(new_data[:-1]):
+            if point.handicap != cleaned_data[-1].handicap:
+                cleaned_data.append(point)
+            else:
+                cleaned_data[-1] = point
+        recent_data = []
+        for entry in new_data:
+            if entry.id <= last_id:
+                break
+            recent_data.append(entry)
+
+        buffer_stop = self.buffer_stop
+        for entry in reversed(recent_data):
+            if buffer_stop is not None and entry.add_time < buffer_stop:
+                continue
+            flags = set()
+            if entry.handicap != last_value:
+                goals = entry.goals if entry.goals is not None else self.goals
+                if goals != self.goals:
+                    continue
+                for line_data in reversed(cleaned_data):
+                    if buffer_stop is not None and line_data.add_time < buffer_stop:
+                        continue
+                    time_difference = entry.add_time - line_data.add_time
+                    if time_difference <= 0:
+                        continue
+                    if time_difference > 150:
+                        break
+                    handicap_change = abs(entry.handicap - line_data.handicap)
+                    if 0.5 <= handicap_change < 0.75:
+                        flag = "SOFT"
+                    elif 0.75 <= handicap_change < 1.0:
+                        flag = "MEDIUM"
+                    elif handicap_change >= 1.0:
+                        flag = "HARD"
+                    else:
+                        continue
+                    if entry.ss != line_data.ss:
+                        events.append(("goal",))
+                        continue
+                    if flag in flags:
+                        continue
+                    flags.add(flag)
+                    direction = 1 if entry.handicap - line_data.handicap > 0 else -1
+                    previous = self.alerts.get(flag)
+                    if previous is not None and direction == previous[2] and (
+                            (direction == 1 and previous[0] <= line_data.handicap < previous[1]) or
+                            (direction == -1 and previous[0] >= line_data.handicap > previous[1])):
+                        events.append(("range",))
+                        continue
+                    events.append(("alert", flag, entry.id, line_data.id, time_difference))
+                    self.alerts[flag] = (line_data.handicap, entry.handicap, direction)
+                self.goals = goals
+            last_value = entry.handicap
+            self.cursors[line_type] = (entry.id, last_value)
+        return events
+
+
+class RecordingOutbox:
+    """Stands in for the AlertOutbox, keeps what kind of message every enqueue was."""
+
+    def __init__(self):
+        self.kinds = []
+
+    def enqueue(self, bot_name: str, **message) -> bool:
+        text = message.get("text", "")
+        if bot_name == "alerts":
+            self.kinds.append("alert")
+        elif text.startswith("Alert Stopped at Range Filter"):
+            self.kinds.append("range")
+        elif "Goal detected within running data" in text:
+            self.kinds.append("goal")
+        return True
+
+
+def run_detector(history: dict, event_id: str, goals: list, buffer_stop: int, incremental: bool,
+                 vectorized: bool) -> tuple:
+    outbox = RecordingOutbox()
+    detector = bot.LineChangeDetector("http://events", "http://odds", "token", alert_outbox=outbox,
+                                      incremental_odds=incremental, vectorized_detection=vectorized)
+    detector.restore_state({event_id: {
+        "details": {"home_team": "Home", "away_team": "Away", "league": "League", "game_time": "10",
+                    "goals": list(goals), "buffer_stop": buffer_stop},
+        "last_processed": {"goals": list(goals)}
+    }})
+    changes = []
+    detect_changes = detector.detect_changes
+
+    async def capture(*args, **kwargs):
+        found = await detect_changes(*args, **kwargs)
+        changes.extend(found)
+        return found
+
+    detector.detect_changes = capture
+    reference = NestedScan(list(goals), buffer_stop)
+    expected = []
+
+    async def feed():
+        points = len(history[LINE_TYPES[0]])
+        for upto in range(5, points + 1, 7):
+            # The odds api sends the latest data point first
+            odds_data = {line_type: list(reversed(data[:upto])) for line_type, data in history.items()}
+            await detector.apply_event_odds({"id": event_id}, odds_data)
+            for line_type in LINE_TYPES:
+                expected.extend(reference.detect(line_type, parse_odds_points(line_type, odds_data[line_type])))
+
+    asyncio.run(feed())
+
+    # The alerts in the order they were sent, with the range filter and goal logs between them
+    alerts = iter(changes)
+    events = []
+    for kind in outbox.kinds:
+        if kind == "alert":
+            change = next(alerts)
+            events.append(("alert", change["change_type"], change["from"].id, change["to"].id,
+                           change["time_difference"]))
+        else:
+            events.append((kind,))
+    state = detector.event_states[event_id]
+    cursors = {line_type: (market.last_id, market.last_value) for line_type, market in state.markets.items()}
+    return events, cursors, state.last_goals, expected, reference
+
+
+MODES = [
+    pytest.param(False, False, id="full"),
+    pytest.param(True, False, id="incremental"),
+    pytest.param(True, True, id="vectorized",
+                 marks=pytest.mark.skipif(not NUMPY_AVAILABLE, reason="numpy is not installed")),
+]
+
+
+@pytest.mark.parametrize("incremental, vectorized", MODES)
+def test_same_alerts_and_cursors_as_nested_scan(monkeypatch, incremental, vectorized):
+    # Every history goes through the numpy path when it is tested
+    monkeypatch.setattr(bot, "VECTORIZE_MIN_POINTS", 3)
+    totals = {"alert": 0, "range": 0, "goal": 0}
+    for seed in range(12):
+        history = odds_history(seed)
+        buffer_stop = START_TIME + 2000 if seed % 4 == 0 else None
+        events, cursors, goals, expected, reference = run_detector(history, f"event{seed}", ["0", "0"],
+                                                                   buffer_stop, incremental, vectorized)
+        assert events == expected, f"seed {seed}"
+        assert cursors == reference.cursors, f"seed {seed}"
+        assert goals == reference.goals, f"seed {seed}"
+        for event in events:
+            totals[event[0]] += 1
+    # The histories have to hit every branch for the comparison to mean anything
+    assert all(totals.values()), totals
@@ -0,0 +1,46 @@
+"""EventLifecycle grace period for missing events, the cap on tracked events and its churn counts."""
+from event_lifecycle import EventLifecycle
+
+
+def test_missing_event_is_kept_for_the_grace_period():
+    lifecycle = EventLifecycle(grace_seconds=120)
+    lifecycle.observe(["a", "b"], now=0)
+    assert lifecycle.observe(["a"], now=60) == {"a", "b"}
+    assert lifecycle.stats()["missing"] == 1
+    assert lifecycle.observe(["a"], now=120) == {"a", "b"}
+    assert lifecycle.observe(["a"], now=121) == {"a"}
+    assert lifecycle.stats() == {"tracked": 1, "missing": 0, "added": 2, "returned": 0, "expired": 1, "capped": 0}
+
+
+def test_event_back_within_the_grace_period_is_returned_not_added():
+    lifecycle = EventLifecycle(grace_seconds=120)
+    lifecycle.observe(["a"], now=0)
+    lifecycle.observe([], now=30)
+    lifecycle.observe(["a"], now=60)
+    lifecycle.observe(["a"], now=90)
+    stats = lifecycle.stats()
+    assert (stats["added"], stats["returned"]) == (1, 1)
+
+
+def test_events_missing_the_longest_are_dropped_over_the_cap():
+    lifecycle = EventLifecycle(grace_seconds=120, max_events=3)
+    lifecycle.observe(["a"], now=0)
+    lifecycle.observe(["b"], now=10)
+    lifecycle.observe(["c"], now=20)
+    assert lifecycle.observe(["d", "e"], now=30) == {"c", "d", "e"}
+    assert lifecycle.stats()["capped"] == 2
+
+
+def test_current_events_are_kept_even_over_the_cap():
+    lifecycle = EventLifecycle(max_events=2)
+    assert lifecycle.observe(["a", "b", "c"], now=0) == {"a", "b", "c"}
+    assert lifecycle.stats()["capped"] == 0
+
+
+def test_forget_stops_tracking_straight_away():
+    lifecycle = EventLifecycle()
+    lifecycle.observe(["a", "b"], now=0)
+    lifecycle.forget(["a", "unknown"])
+    assert lifecycle.tracked() == {"b"}
+    assert lifecycle.observe(["a"], now=10) == {"a", "b"}
+    assert lifecycle.stats()["added"] == 3
@@ -0,0 +1,120 @@
+"""TimerWheel deadlines across slot boundaries and turns of the wheel, and the suspensions SuspensionManager keeps."""
+from event_state import EventState
+from incidents import SuspensionManager, TimerWheel
+
+
+def test_deadline_expires_in_its_tick_not_before():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    wheel.schedule("a", 103.5)
+    assert wheel.advance(102.9) == []
+    # Same slot as the deadline, but earlier in the tick
+    assert wheel.advance(103.2) == []
+    assert wheel.advance(103.5) == ["a"]
+    assert "a" not in wheel and len(wheel) == 0
+
+
+def test_deadlines_in_neighbouring_slots_expire_in_order():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    wheel.schedule("a", 101.9)
+    wheel.schedule("b", 102.1)
+    assert wheel.advance(102.0) == ["a"]
+    assert wheel.advance(102.1) == ["b"]
+
+
+def test_deadline_beyond_one_turn_waits_for_the_turns_between():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    # 20 ticks out on an 8 slot wheel, its slot is passed twice before it is due
+    wheel.schedule("far", 120.0)
+    wheel.schedule("near", 104.0)
+    for now in range(101, 120):
+        expired = wheel.advance(float(now))
+        assert "far" not in expired, now
+    assert "near" not in wheel
+    assert wheel.advance(120.0) == ["far"]
+
+
+def test_gap_longer_than_one_turn_expires_every_slot():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    for offset in range(1, 16):
+        wheel.schedule(offset, 100.0 + offset)
+    assert sorted(wheel.advance(1000.0)) == list(range(1, 16))
+    assert len(wheel) == 0
+
+
+def test_past_deadline_expires_on_the_next_advance():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    wheel.schedule("late", 90.0)
+    assert wheel.advance(100.0) == ["late"]
+
+
+def test_reschedule_and_cancel():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    wheel.schedule("a", 102.0)
+    wheel.schedule("a", 110.0)
+    assert wheel.advance(105.0) == []
+    assert wheel.advance(110.0) == ["a"]
+    wheel.schedule("b", 112.0)
+    wheel.cancel("b")
+    wheel.cancel("b")
+    assert wheel.advance(120.0) == []
+
+
+def test_first_values_are_changes_but_not_incidents():
+    suspensions = SuspensionManager()
+    state = EventState()
+    state.goals, state.penalties, state.red_cards = ["0", "0"], ["0", "0"], ["0", "0"]
+    changed, incidents = suspensions.detect("e", state, now=1000.0)
+    assert changed and incidents == []
+    assert suspensions.detect("e", state, now=1001.0) == (False, [])
+
+
+def test_penalty_suspends_until_its_window_is_over():
+    suspensions = SuspensionManager(windows={"penalty": 150})
+    state = EventState()
+    state.goals, state.penalties = ["0", "0"], ["0", "0"]
+    suspensions.detect("e", state, now=1000.0)
+
+    state.penalties = ["1", "0"]
+    changed, incidents = suspensions.detect("e", state, now=1010.0)
+    assert changed
+    assert [(incident.kind, incident.until) for incident in incidents] == [("penalty", 1160.0)]
+    assert state.buffer_stop == 1160.0
+    assert suspensions.is_suspended("e")
+
+    assert suspensions.advance(now=1159.0) == []
+    assert suspensions.advance(now=1160.0) == ["e"]
+    assert not suspensions.is_suspended("e")
+    assert suspensions.stats() == {"suspended_now": 0, "penalty": 1, "suspended": 1, "resumed": 1}
+
+
+def test_goal_without_window_does_not_suspend():
+    suspensions = SuspensionManager()
+    state = EventState()
+    state.goals = ["0", "0"]
+    suspensions.detect("e", state, now=1000.0)
+    state.goals = ["0", "1"]
+    changed, incidents = suspensions.detect("e", state, now=1010.0)
+    assert changed
+    assert [(incident.kind, incident.until) for incident in incidents] == [("goal", None)]
+    assert not suspensions.is_suspended("e")
+    assert state.buffer_stop is None
+
+
+def test_later_incident_extends_the_suspension():
+    suspensions = SuspensionManager(windows={"penalty": 150, "red_card": 150})
+    state = EventState()
+    state.penalties, state.red_cards = ["0", "0"], ["0", "0"]
+    suspensions.detect("e", state, now=1000.0)
+    state.penalties = ["1", "0"]
+    suspensions.detect("e", state, now=1010.0)
+    state.red_cards = ["0", "1"]
+    suspensions.detect("e", state, now=1100.0)
+    assert suspensions.advance(now=1160.0) == []
+    assert suspensions.advance(now=1250.0) == ["e"]
+    assert suspensions.stats()["suspended"] == 1
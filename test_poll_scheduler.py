@@ -0,0 +1,92 @@
+"""PollScheduler due order, volatility driven intervals and the backoff of events whose odds fetch fails."""
+import random
+
+import pytest
+
+from poll_scheduler import PollScheduler
+
+NOW = 1700000000.0
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    # The backoff delays are the top of their jitter range
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+
+
+def test_never_polled_events_are_due_first_then_the_most_overdue():
+    scheduler = PollScheduler()
+    scheduler.schedule("late", 10, now=NOW - 20)
+    scheduler.schedule("later", 10, now=NOW - 10)
+    scheduler.schedule("not_due", 10, now=NOW)
+    assert scheduler.pop_due(["not_due", "later", "late", "new"], now=NOW) == ["new", "late", "later"]
+    assert scheduler.pop_due(["not_due"], now=NOW) == []
+
+
+def test_due_events_which_are_not_eligible_stay_due():
+    scheduler = PollScheduler()
+    scheduler.schedule("suspended", 10, now=NOW - 10)
+    assert scheduler.pop_due([], now=NOW) == []
+    assert scheduler.pop_due(["suspended"], now=NOW + 1) == ["suspended"]
+
+
+def test_prelive_and_inplay_base_intervals():
+    scheduler = PollScheduler(inplay_interval=5, prelive_interval=30)
+    assert scheduler.schedule("inplay", 10, now=NOW) == NOW + 5
+    assert scheduler.schedule("prelive", "Prelive", now=NOW) == NOW + 30
+
+
+def test_line_moves_shorten_the_interval_down_to_the_minimum():
+    scheduler = PollScheduler(inplay_interval=5, min_interval=1, smoothing=1.0)
+    scheduler.schedule("e", 10, now=NOW)
+    scheduler.record_line_move("e", "1_2")
+    # One move in the minute since the last poll halves the interval
+    assert scheduler.schedule("e", 10, now=NOW + 60) == NOW + 60 + 2.5
+    for _ in range(100):
+        scheduler.record_line_move("e", "1_2")
+    assert scheduler.schedule("e", 10, now=NOW + 120) == NOW + 120 + 1
+
+
+def test_first_half_lines_stop_counting_after_half_time():
+    scheduler = PollScheduler(inplay_interval=5, smoothing=1.0)
+    scheduler.schedule("e", 40, now=NOW)
+    scheduler.record_line_move("e", "1_5")
+    assert scheduler.schedule("e", 44, now=NOW + 60) == NOW + 60 + 2.5
+    assert scheduler.interval("e", 60) == 5
+
+
+def test_failed_fetches_back_off_up_to_the_cap(no_jitter):
+    scheduler = PollScheduler(inplay_interval=5, max_retry_interval=60)
+    delays = [scheduler.schedule_retry("e", 10, now=NOW) - NOW for _ in range(6)]
+    assert delays == [10, 20, 40, 60, 60, 60]
+
+
+def test_successful_fetch_resets_the_backoff(no_jitter):
+    scheduler = PollScheduler(inplay_interval=5, max_retry_interval=60)
+    for _ in range(3):
+        scheduler.schedule_retry("e", 10, now=NOW)
+    assert scheduler.schedule("e", 10, now=NOW) == NOW + 5
+    assert scheduler.schedule_retry("e", 10, now=NOW) == NOW + 10
+
+
+def test_retry_never_comes_sooner_than_the_interval(monkeypatch):
+    monkeypatch.setattr(random, "uniform", lambda low, high: low)
+    scheduler = PollScheduler(inplay_interval=5)
+    assert scheduler.schedule_retry("e", 10, now=NOW) == NOW + 5
+
+
+def test_removed_event_is_new_again():
+    scheduler = PollScheduler()
+    scheduler.schedule("e", 10, now=NOW)
+    scheduler.schedule_retry("e", 10, now=NOW)
+    scheduler.remove("e")
+    assert scheduler.pop_due(["e"], now=NOW) == ["e"]
+    assert "e" not in scheduler.failures
+
+
+def test_stale_heap_entries_are_compacted():
+    scheduler = PollScheduler()
+    for step in range(1000):
+        scheduler.schedule("e", 10, now=NOW + step)
+    assert len(scheduler.heap) <= 2 * len(scheduler.next_due) + 64
+    assert scheduler.pop_due(["e"], now=NOW + 2000) == ["e"]
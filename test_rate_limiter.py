@@ -0,0 +1,75 @@
+"""RequestBudget token refill, priority order of its waiters and changing its rate while they wait."""
+import asyncio
+
+from rate_limiter import RequestBudget
+
+
+def test_burst_is_spent_without_waiting():
+    async def spend():
+        budget = RequestBudget(requests_per_hour=3600, burst=3)
+        for _ in range(3):
+            await asyncio.wait_for(budget.acquire(), 0.05)
+        return budget
+
+    budget = asyncio.run(spend())
+    assert budget.spent_last_hour() == 3
+    assert budget.stats()["waiting"] == 0
+
+
+def test_waiters_are_served_lowest_priority_value_first():
+    async def serve():
+        # 100 tokens a second, one at a time
+        budget = RequestBudget(requests_per_hour=360000, burst=1)
+        await budget.acquire()
+        served = []
+
+        async def request(priority):
+            await budget.acquire(priority)
+            served.append(priority)
+
+        await asyncio.wait_for(asyncio.gather(*(request(priority) for priority in (2, 0, 1, 0))), 2)
+        return served
+
+    assert asyncio.run(serve()) == [0, 0, 1, 2]
+
+
+def test_cancelled_waiter_does_not_take_a_token():
+    async def cancel():
+        budget = RequestBudget(requests_per_hour=360000, burst=1)
+        await budget.acquire()
+        cancelled = asyncio.ensure_future(budget.acquire(0))
+        waiting = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.wait_for(waiting, 1)
+        return budget
+
+    assert asyncio.run(cancel()).spent_last_hour() == 2
+
+
+def test_set_rate_wakes_waiters_at_the_new_rate():
+    async def speed_up():
+        # One token every 100 seconds
+        budget = RequestBudget(requests_per_hour=36, burst=1)
+        await budget.acquire()
+        waiting = asyncio.ensure_future(budget.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        budget.set_rate(360000)
+        await asyncio.wait_for(waiting, 1)
+        return budget
+
+    budget = asyncio.run(speed_up())
+    assert budget.stats()["hourly_budget"] == 360000
+
+
+def test_set_rate_caps_the_tokens_at_the_new_capacity():
+    async def slow_down():
+        budget = RequestBudget(requests_per_hour=36000)
+        assert budget.capacity == 20
+        budget.set_rate(3600)
+        return budget
+
+    budget = asyncio.run(slow_down())
+    assert budget.capacity == 2
+    assert budget.tokens <= 2